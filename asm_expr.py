@@ -0,0 +1,214 @@
+import functools
+import operator
+import re
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+# numbers, labels, $/$$ and operators, in this order
+_token_pattern = re.compile(r"""
+    \s*(?:
+        (?P<num>0x[0-9a-f_]+|0b[01_]+|[0-9][0-9a-f_]*h|[01_]+b
+                |[0-9][0-9_]*)(?![\w.])
+      | (?P<char>'[^']*'|"[^"]*")
+      | (?P<name>[a-z_.?][\w.?@]*)
+      | (?P<here>\$\$|\$)
+      | (?P<op><<|>>|//|[-+*/%&|^~()])
+    )""", re.IGNORECASE | re.VERBOSE)
+
+# larger shift counts would build arbitrarily large numbers
+max_shift = 64
+
+
+def _shift(op):
+    def shift(a, b):
+        if b > max_shift:
+            raise ValueError("shift count {} too large".format(b))
+        return op(a, b)
+    return shift
+
+
+# binary operators by precedence, lowest first
+_binary_ops = (
+    {'|': operator.or_},
+    {'^': operator.xor},
+    {'&': operator.and_},
+    {'<<': _shift(operator.lshift), '>>': _shift(operator.rshift)},
+    {'+': operator.add, '-': operator.sub},
+    {'*': operator.mul, '/': operator.floordiv, '//': operator.floordiv,
+     '%': operator.mod},
+)
+
+_unary_ops = {'-': operator.neg, '+': operator.pos, '~': operator.invert}
+
+
+def _parse_number(text):
+    text = text.lower().replace('_', '')
+    if text.startswith("0x"):
+        return int(text[2:], 16)
+    elif text.endswith('h'):
+        return int(text[:-1], 16)
+    elif text.endswith('b'):
+        return int(text[:-1], 2)
+    elif text.startswith("0b"):
+        return int(text[2:], 2)
+    return int(text)
+
+
+def _parse_char(text):
+    # character constants are little endian, e.g. 'AB' = 0x4241
+    return int.from_bytes(text[1:-1].encode("latin-1"), "little")
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _token_pattern.match(text, pos)
+        if not m or m.end() == pos:
+            raise ExpressionError("invalid expression '{}'".format(text))
+        tokens.append((m.lastgroup, m.group(m.lastgroup)))
+        pos = m.end()
+    return tokens
+
+
+class Expression:
+    """
+    Compiled NASM expression, which is evaluated by calling it with the
+    labels, the position of the line ($) and the start of the section ($$)
+    """
+    def __init__(self, text, fn, names, positional=False):
+        self.text = text
+        self._fn = fn
+        # labels the expression refers to
+        self.names = names
+        # whether the expression refers to $ or $$
+        self.positional = positional
+
+    def __call__(self, labels=None, here=0, start=0):
+        try:
+            return self._fn(labels or {}, here, start)
+        except KeyError as e:
+            raise ExpressionError("unknown label {} in '{}'"
+                                  .format(e, self.text))
+        except (ZeroDivisionError, TypeError, ValueError, OverflowError,
+                MemoryError) as e:
+            raise ExpressionError("can't evaluate '{}': {}"
+                                  .format(self.text, e))
+
+    def is_constant(self):
+        return not self.names and not self.positional
+
+    def __repr__(self):
+        return "Expression({!r})".format(self.text)
+
+
+class _Parser:
+    """
+    Recursive descent parser, which turns the tokens into nested closures
+    """
+    def __init__(self, tokens, text):
+        self.tokens = tokens
+        self.text = text
+        self.pos = 0
+        self.names = set()
+        self.positional = False
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _error(self):
+        return ExpressionError("invalid expression '{}'".format(self.text))
+
+    def parse(self):
+        fn = self._binary(0)
+        if self._peek() is not None:
+            raise self._error()
+        return fn
+
+    def _binary(self, level):
+        if level == len(_binary_ops):
+            return self._unary()
+
+        ops = _binary_ops[level]
+        lhs = self._binary(level + 1)
+        while True:
+            tok = self._peek()
+            if tok is None or tok[0] != "op" or tok[1] not in ops:
+                return lhs
+            self.pos += 1
+            lhs = self._combine(ops[tok[1]], lhs, self._binary(level + 1))
+
+    @staticmethod
+    def _combine(op, lhs, rhs):
+        return lambda labels, here, start: op(lhs(labels, here, start),
+                                              rhs(labels, here, start))
+
+    def _unary(self):
+        tok = self._peek()
+        if tok is not None and tok[0] == "op" and tok[1] in _unary_ops:
+            self.pos += 1
+            op, operand = _unary_ops[tok[1]], self._unary()
+            return lambda labels, here, start: op(
+                operand(labels, here, start))
+        return self._atom()
+
+    def _atom(self):
+        tok = self._peek()
+        if tok is None:
+            raise self._error()
+        self.pos += 1
+
+        kind, val = tok
+        if kind == "num":
+            num = _parse_number(val)
+            return lambda labels, here, start: num
+        elif kind == "char":
+            num = _parse_char(val)
+            return lambda labels, here, start: num
+        elif kind == "name":
+            self.names.add(val)
+            return lambda labels, here, start: labels[val]
+        elif kind == "here":
+            self.positional = True
+            if val == "$$":
+                return lambda labels, here, start: start
+            return lambda labels, here, start: here
+        elif val == '(':
+            fn = self._binary(0)
+            if self._peek() != ("op", ')'):
+                raise self._error()
+            self.pos += 1
+            return fn
+
+        raise self._error()
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_expression(text):
+    """
+    Compile a NASM expression. Only numbers, labels, $, $$ and arithmetic
+    and bitwise operators are accepted. Compiled expressions are cached by
+    their text, so the same expression is parsed once for all submissions.
+    :param text: expression, e.g. '$-gdt'
+    :return: Expression
+    """
+    text = text.strip()
+    parser = _Parser(_tokenize(text), text)
+    fn = parser.parse()
+    return Expression(text, fn, frozenset(parser.names), parser.positional)
+
+
+def evaluate(text, labels=None, here=0, start=0):
+    """
+    Evaluate a NASM expression
+    :param text: expression
+    :param labels: dict of label -> value
+    :param here: value of $
+    :param start: value of $$
+    :return: value of the expression
+    """
+    return compile_expression(text)(labels, here, start)
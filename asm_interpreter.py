@@ -2,7 +2,18 @@ import logging
 import re
 import itertools
 import struct
-import ast
+import functools
+import collections
+import collections.abc
+import copy
+
+try:
+    import numpy
+except ImportError:  # bulk decoding falls back to struct
+    numpy = None
+
+import timing
+from asm_expr import ExpressionError, compile_expression, evaluate
 
 
 def _parse_number(val):
@@ -24,42 +35,55 @@ def _strip_line(line):
     return line.strip()
 
 
-def _tokenize_line(line):
-    line = _strip_line(line)
+# the command is the leading word of a line
+_cmd_pattern = re.compile(r"\w*")
 
-    if '+' in line or '*' in line:
-        a = 5
 
-    tokens = re.split("\W+", line)
+class SourceLine(str):
+    """
+    Line of source code, which is tokenized once when it is read. The string
+    itself is the stripped line including comments, the tokens are kept as
+    attributes, so every consumer can use them without scanning the line
+    again.
+    """
+    def __new__(cls, line, nr=None):
+        self = super().__new__(cls, line.strip())
+        self.nr = nr
+        # line without comments and whitespaces
+        self.text = text = _strip_line(line)
+        # command is always the first word
+        self.cmd = cmd = _cmd_pattern.match(text).group()
+        # params are separated by ','
+        self.params = [p.strip() for p in text.replace(cmd, '').split(',')]
+        return self
 
-    # command is always the first word
-    cmd = tokens[0]
-    # params are separated by ','
-    params = [p.strip() for p in line.replace(cmd, '').split(',')]
 
-    return cmd, params
+class TokenStream(list):
+    """
+    Source code as list of SourceLines
+    """
+    pass
 
 
-def _eval_statement(stmt, labels):
-    class ResolveLabel(ast.NodeTransformer):
-        def __init__(self, labels):
-            self.labels = labels
+def tokenize(lines):
+    """
+    Tokenize the source code once, lines which are tokenized already are
+    reused
+    :param lines: lines of source code or SourceLines
+    :return: TokenStream of the lines
+    """
+    if isinstance(lines, TokenStream):
+        return lines
 
-        def visit_Name(self, node):
-            return ast.copy_location(
-                ast.Num(n=self.labels.get(node.id, node.id),
-                        ctx=node.ctx),
-                node)
+    return TokenStream(l if isinstance(l, SourceLine) else SourceLine(l, nr)
+                       for nr, l in enumerate(lines))
 
-    node = ast.parse(stmt.strip(), mode="eval")
-    # resolve labels to their numerical value
-    node = ResolveLabel(labels).visit(node)
-    try:
-        val = ast.literal_eval(node)
-    except Exception as e:
-        a = 5
 
-    return val
+def _tokenize_line(line):
+    if not isinstance(line, SourceLine):
+        line = SourceLine(line)
+
+    return line.cmd, line.params
 
 
 def _determine_opsize(dst, src):
@@ -157,6 +181,114 @@ def _parse_interrupt_descriptor(intbytes):
     }
 
 
+_int_types = ("invalid",) * 5 + ("task_gate", "interrupt_gate", "trap_gate")
+
+# raw fields and derived columns of the descriptor tables. The derivations
+# get the raw fields in order and work on single values as well as on numpy
+# arrays, they match _parse_segment_descriptor and
+# _parse_interrupt_descriptor.
+_segment_layout = (
+    struct.Struct("<HHBBBB"),
+    ("<u2", "<u2", "u1", "u1", "u1", "u1"),
+    {
+        "seglimit": lambda lim, b1, b2, fl, misc, b3: (
+            lim + ((misc & 0x0f) << 16)),
+        "base_addr": lambda lim, b1, b2, fl, misc, b3: (
+            b1 + (b2 << 16) + (b3 << 24)),
+        "type": lambda lim, b1, b2, fl, misc, b3: fl & 0x0f,
+        "s": lambda lim, b1, b2, fl, misc, b3: (fl & 0x10) != 0,
+        "dpl": lambda lim, b1, b2, fl, misc, b3: (fl & 0x60) >> 5,
+        "p": lambda lim, b1, b2, fl, misc, b3: (fl & 0x80) != 0,
+        "avl": lambda lim, b1, b2, fl, misc, b3: (misc & 0x10) != 0,
+        "l": lambda lim, b1, b2, fl, misc, b3: (misc & 0x20) != 0,
+        "db": lambda lim, b1, b2, fl, misc, b3: (misc & 0x40) != 0,
+        "g": lambda lim, b1, b2, fl, misc, b3: (misc & 0x80) != 0,
+    })
+
+_interrupt_layout = (
+    struct.Struct("<HHBBH"),
+    ("<u2", "<u2", "u1", "u1", "<u2"),
+    {
+        "offset": lambda ofs1, sel, dummy, fl, ofs2: ofs1 + (ofs2 << 16),
+        "segment": lambda ofs1, sel, dummy, fl, ofs2: sel,
+        "dummy": lambda ofs1, sel, dummy, fl, ofs2: dummy,
+        "int_type": lambda ofs1, sel, dummy, fl, ofs2: (
+            _lookup(_int_types, fl & 0x07)),
+        "d": lambda ofs1, sel, dummy, fl, ofs2: (fl & 0x08) >> 3,
+        # same as (flags & 0x60) >> 4 and flags * 0x80 of the entry parser
+        "dpl": lambda ofs1, sel, dummy, fl, ofs2: (fl & 0x60) >> 4,
+        "p": lambda ofs1, sel, dummy, fl, ofs2: fl != 0,
+    })
+
+
+def _lookup(table, idx):
+    if numpy is not None and isinstance(idx, numpy.ndarray):
+        return numpy.asarray(table)[idx]
+    return table[idx]
+
+
+class DescriptorTable:
+    """
+    Columnar view of all entries of a descriptor table. columns maps every
+    field to a sequence with one value per entry, indexing the table gives
+    the entry as dict like the per entry parsers do.
+    """
+    def __init__(self, columns, count):
+        self.columns = columns
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, nr):
+        if not -self._count <= nr < self._count:
+            raise IndexError("descriptor index out of range")
+        return {k: _to_python(col[nr]) for k, col in self.columns.items()}
+
+    def __iter__(self):
+        return (self[nr] for nr in range(self._count))
+
+
+def _to_python(val):
+    # numpy scalars compare and pickle differently than python values
+    return val.item() if hasattr(val, "item") else val
+
+
+def decode_descriptor_table(buf, is_seg_descriptor=True):
+    """
+    Decode all 8 byte entries of a descriptor table at once. A short last
+    entry is padded with 0xff like the per entry parsers do.
+    :param buf: bytes of the table
+    :param is_seg_descriptor: segment (GDT) or interrupt (IDT) descriptors
+    :return: DescriptorTable
+    """
+    fmt, dtypes, derived = (_segment_layout if is_seg_descriptor
+                            else _interrupt_layout)
+    view = memoryview(buf).cast('B')
+    tail = len(view) % fmt.size
+    if tail:
+        # only the ragged end is copied
+        last = bytes(view[len(view) - tail:]) + b'\xff' * (fmt.size - tail)
+        view = view[:len(view) - tail]
+    else:
+        last = b''
+
+    count = (len(view) + len(last)) // fmt.size
+    if numpy is not None:
+        dtype = [("f{}".format(nr), t) for nr, t in enumerate(dtypes)]
+        raw = numpy.frombuffer(view, dtype=dtype)
+        if last:
+            raw = numpy.concatenate([raw, numpy.frombuffer(last, dtype)])
+        raw = [raw[name].astype(numpy.int64) for name, _ in dtype]
+        columns = {k: fn(*raw) for k, fn in derived.items()}
+    else:
+        rows = itertools.chain(fmt.iter_unpack(view), fmt.iter_unpack(last))
+        raw = list(zip(*rows)) or [()] * len(dtypes)
+        columns = {k: list(map(fn, *raw)) for k, fn in derived.items()}
+
+    return DescriptorTable(columns, count)
+
+
 def _get_define_bytecount(cmd):
     cmd = cmd.lower()
     if cmd == "dw":
@@ -170,50 +302,551 @@ def _get_define_bytecount(cmd):
         return 0
 
 
+# bytes per element of the data directives
+_data_sizes = {"db": 1, "dw": 2, "dd": 4, "dq": 8}
+# largest memory image assemble builds, the real mode address space
+max_image_size = 0x100000
+_reserve_sizes = {"resb": 1, "resw": 2, "resd": 4, "resq": 8}
+
+_equ_pattern = re.compile(r"^(\w+)\s+equ\s+(.+)$", re.IGNORECASE)
+_times_pattern = re.compile(r"^times\s+(.+?)\s+((?:d[bwdq]|res[bwdq])\b.*)$",
+                            re.IGNORECASE)
+_data_pattern = re.compile(r"^(?:(\w+)\s+)?(d[bwdq]|res[bwdq])\b\s*(.*)$",
+                           re.IGNORECASE)
+_org_pattern = re.compile(r"^\[?\s*org\s+([^\]]+)\]?$", re.IGNORECASE)
+_data_operand_pattern = re.compile(r"""'[^']*'|"[^"]*"|[^,]+""")
+# marks the placeholder byte of an instruction in the image
+_instruction = object()
+
+
+class MemoryImage:
+    """
+    Flat memory image of the data of a program. Instructions aren't encoded,
+    every instruction takes a single placeholder byte (nop) instead.
+    """
+    def __init__(self, data, labels, origin=0, equates=None):
+        self.data = data
+        # label -> address
+        self.labels = labels
+        # address of the first byte
+        self.origin = origin
+        # equ label -> (expression, $ of the definition) in source order
+        self.equates = equates if equates is not None else {}
+
+    @property
+    def memory(self):
+        return memoryview(self.data)
+
+    def read(self, addr, size):
+        """
+        :return: memoryview of the bytes at the address, which is shorter if
+        the range exceeds the image
+        """
+        start = max(addr - self.origin, 0)
+        return self.memory[start:max(addr - self.origin + size, start)]
+
+    def unpack(self, fmt, addr):
+        """
+        Unpack a struct at the address, e.g. the pseudo descriptor of lgdt
+        :return: tuple of values or None if the address is out of range
+        """
+        if addr < self.origin:
+            # unpack_from would count negative offsets from the end
+            return None
+        try:
+            return struct.unpack_from(fmt, self.data, addr - self.origin)
+        except struct.error:
+            return None
+
+
+_Equate = collections.namedtuple("_Equate", ["expr", "here", "start"])
+
+
+class SymbolTable(collections.abc.Mapping):
+    """
+    Labels and equ definitions of a program. Definitions are only indexed
+    while assembling, an equ expression is evaluated when the symbol is
+    first looked up, following the symbols it refers to.
+    """
+    def __init__(self, parent=None):
+        # name -> value or _Equate of a pending equ definition
+        self._defs = {}
+        # own symbols first, then the symbols defined outside
+        self.scope = collections.ChainMap(self, parent or {})
+        # equ definitions being resolved, to detect cycles
+        self._resolving = set()
+        # failed equ definitions are only final once all labels are known
+        self.complete = False
+
+    def define(self, name, value):
+        self._defs[name] = value
+
+    def define_equ(self, name, expr, here, start):
+        self._defs[name] = _Equate(expr, here, start)
+
+    def __getitem__(self, name):
+        val = self._defs[name]
+        if type(val) is _Equate:
+            return self._resolve(name, val)
+        return val
+
+    def __contains__(self, name):
+        return name in self._defs
+
+    def __iter__(self):
+        return iter(self._defs)
+
+    def __len__(self):
+        return len(self._defs)
+
+    def _resolve(self, name, equ):
+        if name in self._resolving:
+            raise ExpressionError("cyclic definition of {}".format(name))
+
+        self._resolving.add(name)
+        try:
+            val = evaluate(equ.expr, self.scope, equ.here, equ.start)
+        except ExpressionError as e:
+            if not self.complete:
+                # may refer to labels defined later on
+                raise
+            logging.warning("Invalid definition of {}: {}".format(name, e))
+            val = -1
+            self._defs[name] = val
+            if len(self._resolving) > 1:
+                # the symbol referring to this one fails as well
+                raise
+        finally:
+            self._resolving.discard(name)
+
+        self._defs[name] = val
+        return val
+
+
+def _split_data_operands(params):
+    return [p.strip() for p in _data_operand_pattern.findall(params)
+            if p.strip()]
+
+
+def _data_size(directive, operands):
+    unit = _data_sizes[directive]
+    size = 0
+    for p in operands:
+        if p[0] in "'\"":
+            # strings are padded to whole units
+            size += -(-(len(p) - 2) // unit) * unit
+        else:
+            size += unit
+    return size
+
+
+def _encode_data(directive, operands, labels, here, start):
+    unit = _data_sizes[directive]
+    data = bytearray()
+    for p in operands:
+        if p[0] in "'\"":
+            data += p[1:-1].encode("latin-1")
+            data += bytes(-len(data) % unit)
+        else:
+            try:
+                val = evaluate(p, labels, here, start)
+            except ExpressionError as e:
+                logging.error("Couldn't assemble '{} {}': {}"
+                              .format(directive, ', '.join(operands), e))
+                val = 0
+            data += (val & ((1 << 8 * unit) - 1)).to_bytes(unit, "little")
+    return data
+
+
+@functools.lru_cache(maxsize=65536)
+def _parse_layout(text):
+    """
+    Parse what a line contributes to the memory image, the result only
+    depends on the text, so it's shared by all submissions
+    :param text: line without comments
+    :return: 3-tuple of label, kind of the line and its arguments
+    """
+    m = _org_pattern.match(text)
+    if m:
+        return None, "org", m.group(1)
+    elif text.startswith('['):
+        # other directives, e.g. [bits 32]
+        return None, None, None
+
+    label = None
+    m = _label_pattern.match(text)
+    if m:
+        label, text = m.groups()
+
+    m = _equ_pattern.match(text)
+    if m:
+        return label, "equ", m.groups()
+
+    times = None
+    m = _times_pattern.match(text)
+    if m:
+        times, text = m.groups()
+
+    m = _data_pattern.match(text)
+    if not m:
+        return label, ("ins" if text else None), None
+
+    name, directive, params = m.groups()
+    directive = directive.lower()
+    if directive in _reserve_sizes:
+        return label, "res", (name, times, directive, params)
+
+    operands = tuple(_split_data_operands(params))
+    try:
+        # data without labels and $ is encoded once
+        if all(p[0] in "'\"" or compile_expression(p).is_constant()
+               for p in operands):
+            operands = bytes(_encode_data(directive, operands, {}, 0, 0))
+    except ExpressionError:
+        pass
+    return label, "data", (name, times, directive, operands)
+
+
+def assemble(lines, labels=None):
+    """
+    Lay out all data of the code (db, dw, dd, dq, res*, times) in a flat
+    memory image. Labels resolve to their address in the image, equ labels
+    to the value of their expression.
+    :param lines: lines of source code or SourceLines
+    :param labels: labels defined outside of the code, e.g. when assembling
+    a part of a program
+    :return: MemoryImage
+    """
+    local = SymbolTable(labels)
+    scope = local.scope
+    origin = 0
+    addr = 0
+    # pending data as (offset, directive, operands, $, repetitions)
+    pending = []
+    equates = {}
+
+    for l in tokenize(lines):
+        label, kind, args = _parse_layout(l.text)
+        if label:
+            local.define(label, addr)
+
+        if kind is None:
+            continue
+        elif kind == "org":
+            try:
+                if addr != origin:
+                    raise ExpressionError("org after data")
+                origin = addr = evaluate(args, scope)
+            except ExpressionError as e:
+                logging.warning("Invalid origin: {}".format(e))
+            continue
+        elif kind == "equ":
+            name, expr = args
+            equates[name] = (expr, addr)
+            local.define_equ(name, expr, addr, origin)
+            continue
+        elif kind == "ins":
+            # instructions aren't encoded, a placeholder keeps the addresses
+            # of code labels distinct and in order
+            pending.append((addr - origin, _instruction, None, addr, 1))
+            addr += 1
+            continue
+
+        name, times, directive, operands = args
+        if name:
+            local.define(name, addr)
+
+        count = 1
+        if times:
+            try:
+                count = max(evaluate(times, scope, addr, origin), 0)
+            except ExpressionError as e:
+                logging.warning("Invalid repetition '{}': {}".format(l, e))
+                count = 0
+
+        if kind == "res":
+            try:
+                size = _reserve_sizes[directive] * evaluate(operands, scope)
+            except ExpressionError as e:
+                logging.warning("Invalid reservation '{}': {}".format(l, e))
+                size = 0
+        else:
+            size = (len(operands) if isinstance(operands, bytes)
+                    else _data_size(directive, operands))
+
+        # the sizes are up to the submission, don't allocate arbitrary
+        # amounts of memory
+        if size < 0 or addr - origin + size * count > max_image_size:
+            logging.warning("Invalid size of '{}': {} bytes exceed the memory"
+                            " image".format(l, size * count))
+            count = 0
+
+        if kind == "res":
+            pending.append((addr - origin, None, size, addr, count))
+        else:
+            pending.append((addr - origin, directive, operands, addr, count))
+        addr += size * count
+
+    # equ definitions are resolved on first use
+    local.complete = True
+
+    data = bytearray(addr - origin)
+    for offset, directive, operands, here, count in pending:
+        if directive is None:
+            # reserved space stays zeroed
+            continue
+        elif directive is _instruction:
+            data[offset] = 0x90  # nop
+            continue
+        if isinstance(operands, bytes):
+            chunk = operands
+        else:
+            # $ is the start of the line for all repetitions
+            chunk = _encode_data(directive, operands, scope, here, origin)
+        data[offset:offset + len(chunk) * count] = chunk * count
+
+    return MemoryImage(data, local, origin, equates)
+
+
+# operand kinds of decoded instructions
+OPND_IMM = 0  # pre-parsed immediate value
+OPND_REG = 1  # register
+OPND_LABEL = 2  # label, which is resolved on execution
+OPND_INVALID = 3  # anything the interpreter can't handle (yet)
+OPND_MEM = 4  # memory reference, the value is the address expression
+OPND_EXPR = 5  # compiled expression, which refers to labels
+
+Operand = collections.namedtuple("Operand", ["kind", "value"])
+Instruction = collections.namedtuple(
+    "Instruction", ["opcode", "handler", "operands", "line"])
+
+# line starting with a label, e.g. "hang: jmp hang"
+_label_pattern = re.compile(r"^(\w+):\s*(.*)$")
+
+
+class Program(tuple):
+    """
+    Decoded instructions. targets maps the labels of the code to the index
+    of the instruction following them.
+    """
+    def __new__(cls, instructions, targets):
+        self = super().__new__(cls, instructions)
+        self.targets = targets
+        return self
+
+
+def _decode_operand(src, role='s'):
+    """
+    Classify an operand once, instead of resolving it anew on every
+    execution
+    :param src: operand as written in the source
+    :param role: 'd' for operands which get written, 's' for values, 't' for
+    jump targets and 'm' for memory references
+    :return: Operand
+    """
+    if role == 'd':
+        key = Registers.get_reg_key(src)
+        return (Operand(OPND_REG, key) if key is not None
+                else Operand(OPND_INVALID, src))
+    elif role == 't':
+        # far jumps name the segment selector first, e.g. code:pmode
+        return Operand(OPND_LABEL, src.split(':')[-1].strip())
+    elif role == 'm':
+        if src.startswith('[') and src.endswith(']'):
+            return Operand(OPND_MEM, src[1:-1].strip())
+        return Operand(OPND_INVALID, src)
+
+    if any((c in '+-*/') for c in src):
+        try:
+            expr = compile_expression(src)
+            if expr.names:
+                return Operand(OPND_EXPR, expr)
+            return Operand(OPND_IMM, expr())
+        except ExpressionError:
+            logging.warning("couldn't evaluate expression '{}'".format(src))
+
+    try:
+        return Operand(OPND_IMM, _parse_number(src))
+    except ValueError:  # src is no value
+        if AsmInterpreter._is_register(src):
+            return Operand(OPND_REG, Registers.get_reg_key(src))
+        return Operand(OPND_LABEL, src)
+
+
+def decode_line(line):
+    """
+    Decode a single line into an instruction
+    :param line: line of source code or SourceLine
+    :return: Instruction or None if the line can't be executed
+    """
+    cmd, params = _tokenize_line(line)
+    cmd = cmd.lower()
+    opcode = AsmInterpreter.opcodes.get(cmd)
+    if opcode is None:
+        logging.warning("Command '{}' not recognized!".format(cmd))
+        logging.warning("Didn't handle line '{}'".format(line))
+        return None
+
+    name, roles = AsmInterpreter.instructions[cmd]
+    params = [p for p in params if p]
+    if cmd == "mov" and len(params) == 3:
+        # leading operand size
+        params = params[1:]
+    if len(params) != len(roles):
+        logging.warning("--- strange {} cmd: {}".format(cmd, line))
+        return None
+
+    operands = tuple(_decode_operand(p, r) for p, r in zip(params, roles))
+    for opnd in operands:
+        if opnd.kind == OPND_INVALID:
+            logging.warning("Can't handle operand '{}' in line '{}'"
+                            .format(opnd.value, line))
+            return None
+
+    return Instruction(opcode, getattr(AsmInterpreter, name), operands,
+                       str(line))
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_cached(lines):
+    instructions = []
+    targets = {}
+    for l in lines:
+        m = _label_pattern.match(_strip_line(l))
+        if m:
+            targets[m.group(1)] = len(instructions)
+            l = m.group(2)
+            if not l:
+                continue
+
+        ins = decode_line(l)
+        if ins is not None:
+            instructions.append(ins)
+
+    return Program(instructions, targets)
+
+
+def decode(lines):
+    """
+    Decode the source lines into instructions once. Decoded programs are
+    cached, so identical code of different submissions is decoded only once.
+    :param lines: lines of source code or SourceLines
+    :return: Program
+    """
+    return _decode_cached(tuple(str(l) for l in lines))
+
+
+# eflags bits
+_CF = 0x0001
+_ZF = 0x0040
+_SF = 0x0080
+
+
+def _update_flags(flags, res, mask, carry):
+    """
+    Set carry, zero and sign flag for the result of an operation, works on
+    single values as well as on numpy arrays
+    """
+    res = res & mask
+    return ((flags & ~(_CF | _ZF | _SF)) | (carry != 0) * _CF |
+            (res == 0) * _ZF | ((res & ~(mask >> 1)) != 0) * _SF)
+
+
+# result and carry of the arithmetic/logic instructions
+_alu_ops = {
+    "or": (lambda a, b: a | b, None),
+    "and": (lambda a, b: a & b, None),
+    "xor": (lambda a, b: a ^ b, None),
+    "add": (lambda a, b: a + b,
+            lambda a, b, mask: (a & mask) + (b & mask) > mask),
+    "sub": (lambda a, b: a - b,
+            lambda a, b, mask: (a & mask) < (b & mask)),
+}
+
+
+def _label_value(kind, val, labels):
+    """
+    Resolve a label or expression operand
+    :return: value of the operand, 0 if it can't be resolved
+    """
+    if kind == OPND_EXPR:
+        try:
+            return val(labels)
+        except ExpressionError as e:
+            logging.warning("Invalid source value: {}".format(e))
+            return 0
+    elif val in labels:
+        return labels[val]
+
+    logging.warning("Invalid source value: {}".format(val))
+    return 0
+
+
+def _build_reg_aliases(names):
+    """
+    Build the lookup table for all register names
+    :param names: names of the full registers in slot order
+    :return: dict of register name to 3-tuple of slot, mask and shift
+    """
+    aliases = {}
+    for slot, name in enumerate(names):
+        width = 0xffff if Registers._is_segment(name) else 0xffffffff
+        aliases[name] = (slot, width, 0)
+
+        if name[0] == 'e' and len(name) == 3:
+            # 16 bit alias of general purpose registers
+            aliases[name[1:]] = (slot, 0xffff, 0)
+            if name[2] == 'x':
+                aliases[name[1] + 'h'] = (slot, 0xff, 8)
+                aliases[name[1] + 'l'] = (slot, 0xff, 0)
+
+    return aliases
+
+
 class Registers:
+    __slots__ = ("_slots",)
+
+    _names = ("eax", "ebx", "ecx", "edx", "esi", "edi", "ebp", "esp",
+              # segments
+              "cs", "ds", "es", "fs", "gs", "ss",
+              # special
+              "cr0", "cr1", "cr2", "cr3", "eflags")
+
     def __init__(self):
-        self._regs = {
-            "eax": 0,
-            "ebx": 0,
-            "ecx": 0,
-            "edx": 0,
-            "esi": 0,
-            "edi": 0,
-            "ebp": 0,
-            "esp": 0,
-
-            # segments
-            "cs": 0,
-            "ds": 0,
-            "es": 0,
-            "fs": 0,
-            "gs": 0,
-            "ss": 0,
-
-            # special
-            "cr0": 0,
-            "cr1": 0,
-            "cr2": 0,
-            "cr3": 0,
-            "eflags": 0
-        }
+        self._slots = [0] * len(self._names)
 
     def __getitem__(self, reg):
-        reg, mask = self._get_reg_key(reg)
-        val = self._regs[reg]
-
-        return val & mask if mask else val
+        return self.read(_reg_aliases[reg.lower()])
 
     def __setitem__(self, reg, value):
-        reg, mask = self._get_reg_key(reg)
-
-        if mask:
-            self._regs[reg] = value & mask
-        else:
-            self._regs[reg] = value
+        self.write(_reg_aliases[reg.lower()], value)
 
     def __iter__(self):
-        return self._regs.__iter__()
+        return iter(self._names)
+
+    def __contains__(self, reg):
+        return reg.lower() in _reg_aliases
+
+    def copy(self):
+        regs = Registers.__new__(Registers)
+        regs._slots = list(self._slots)
+        return regs
+
+    def read(self, key):
+        """
+        Read a register by a key already resolved with get_reg_key
+        """
+        slot, mask, shift = key
+        return (self._slots[slot] >> shift) & mask
+
+    def write(self, key, value):
+        """
+        Write a register by a key already resolved with get_reg_key. Only the
+        bits of the addressed (sub-)register are changed.
+        """
+        slot, mask, shift = key
+        self._slots[slot] = ((self._slots[slot] & ~(mask << shift)) |
+                             ((value & mask) << shift))
 
     @staticmethod
     def _is_segment(name):
@@ -223,127 +856,261 @@ class Registers:
 
         return False
 
-    def _get_reg_key(self, name):
+    @staticmethod
+    def get_reg_key(name):
         """
-        Get the proper key of the given register name
+        Get the key of the given register name
         :param name: name of the register which should be looked up
-        :return: 2-tuple of full name of the register and mask to access the
-        wanted byte(s), if the registername indicates a restriction
+        :return: 3-tuple of slot, mask and shift to access the wanted byte(s)
+        or None, if the name denotes no register
         """
-        name = name.lower()
-        if len(name) == 3 and name in self._regs:
-            return name, None
-        elif len(name) == 2:
-            if self._is_segment(name):
-                return name, None
-            elif name[-1] in ['x', 'h', 'l'] and name[0] in 'abcd':
-                mask = (0xffff if name[-1] == 'x' else
-                        0xff00 if name[-1] == 'h' else 0x00ff)
-                return ''.join(['e', name[0], 'x']), mask
-            else:
-                return name in ["si", 'di', 'bp', 'sp'], None
+        return _reg_aliases.get(name.lower())
+
+
+_reg_aliases = _build_reg_aliases(Registers._names)
+_eflags = _reg_aliases["eflags"]
+_esp = _reg_aliases["esp"]
+_ecx = _reg_aliases["ecx"]
 
 
 class AsmInterpreter:
-    def __init__(self, code, labels=None):
-        self.lines = code
+    # handler and operand roles per mnemonic, see _decode_operand
+    instructions = {
+        "mov": ("_exec_mov", "ds"),
+        "or": ("_exec_or", "ds"),
+        "and": ("_exec_and", "ds"),
+        "xor": ("_exec_xor", "ds"),
+        "add": ("_exec_add", "ds"),
+        "sub": ("_exec_sub", "ds"),
+        "cmp": ("_exec_cmp", "ss"),
+        "inc": ("_exec_inc", "d"),
+        "dec": ("_exec_dec", "d"),
+        "shl": ("_exec_shl", "ds"),
+        "sal": ("_exec_shl", "ds"),
+        "shr": ("_exec_shr", "ds"),
+        "push": ("_exec_push", "s"),
+        "pop": ("_exec_pop", "d"),
+        "jmp": ("_exec_jmp", "t"),
+        "loop": ("_exec_loop", "t"),
+        "call": ("_exec_call", "t"),
+        "ret": ("_exec_ret", ""),
+        "retn": ("_exec_ret", ""),
+        "iret": ("_exec_ret", ""),
+        "int": ("_exec_int", "s"),
+        "lidt": ("_exec_load_table", "m"),
+        "lgdt": ("_exec_load_table", "m"),
+        "cli": ("_exec_nop", ""),
+        "sti": ("_exec_nop", ""),
+        "nop": ("_exec_nop", ""),
+        "hlt": ("_exec_hlt", ""),
+    }
+
+    # conditions of the conditional jumps on eflags, the overflow flag isn't
+    # tracked, so signed comparisons only look at the sign
+    conditions = {
+        "je": lambda f: f & 0x40, "jz": lambda f: f & 0x40,
+        "jne": lambda f: not f & 0x40, "jnz": lambda f: not f & 0x40,
+        "jb": lambda f: f & 0x01, "jc": lambda f: f & 0x01,
+        "jae": lambda f: not f & 0x01, "jnc": lambda f: not f & 0x01,
+        "jbe": lambda f: f & 0x41, "ja": lambda f: not f & 0x41,
+        "js": lambda f: f & 0x80, "jns": lambda f: not f & 0x80,
+        "jl": lambda f: f & 0x80, "jge": lambda f: not f & 0x80,
+        "jle": lambda f: f & 0xc0, "jg": lambda f: not f & 0xc0,
+    }
+    instructions.update((cmd, ("_exec_jcc", "t")) for cmd in conditions)
+
+    # opcodes are the indices of the mnemonics
+    mnemonics = tuple(instructions)
+    opcodes = {cmd: nr for nr, cmd in enumerate(mnemonics)}
+
+    # eflags bits
+    CF = _CF
+    ZF = _ZF
+    SF = _SF
+
+    # executed instructions per interpret call, so endless loops terminate
+    max_steps = 10000
+
+    def __init__(self, code, labels=None, max_steps=None, tracer=None):
+        self.lines = tokenize(code)
         # self.regs = self._init_registers()
         self.regs = Registers()
-        self.labels = labels if labels is not None else self.extract_labels()
-
+        # the code is only assembled once image or labels are used
+        self._assembled = None
+        self._labels = labels
+        self._program = None
+        if max_steps is not None:
+            self.max_steps = max_steps
+        # see asm_trace.Tracer, None runs without instrumentation
+        self.tracer = tracer
+
+        # execution state
+        self.pc = 0
+        self.steps = 0
+        self.stack = []
+        self.exhausted = False
+        self._running = ()
+
+        # recorded side effects
+        self.calls = []
+        self.interrupts = []
+        self.loaded_tables = []
+        # lgdt/lidt -> (limit, base) read from memory
+        self.tables = {}
+
+    @timing.timed("extract_labels")
     def extract_labels(self):
-        labels = {}
-        for nr, l in enumerate([_strip_line(l) for l in self.lines]):
-            label = None
-            val = -1
+        """
+        Assemble the code into a memory image, the labels resolve to their
+        addresses in it
+        :return: dict of label -> address
+        """
+        self.image = assemble(self.lines)
+        return self.image.labels
+
+    @property
+    def image(self):
+        """
+        MemoryImage of the code, assembled on first use
+        """
+        if self._assembled is None:
+            if self._labels is None:
+                self.extract_labels()
+            else:
+                self._assembled = assemble(self.lines, self._labels)
+        return self._assembled
+
+    @image.setter
+    def image(self, image):
+        self._assembled = image
+
+    @property
+    def labels(self):
+        """
+        Labels the code refers to, the labels of the code itself unless
+        others were given
+        """
+        return self.image.labels if self._labels is None else self._labels
+
+    @labels.setter
+    def labels(self, labels):
+        self._labels = labels
+        # the image has to be assembled with the new labels
+        self._assembled = None
 
-            if ':' in l:
-                label = l.replace(':', '')
-                val = nr
-            elif 'equ' in l:
-                # extract label
-                idx = l.index(' equ ')
-                label = l[:idx]
-
-                # parse definition
-                idx += 5
-                stmt = l[idx:].replace('$', str(nr))
-                val = _eval_statement(stmt, labels)
-            elif 'db' in l:
-                idx = l.index('db')
-                if idx > 1:
-                    label = l[:idx].strip()
-                    val = nr
-
-            if label:
-                labels[label] = val
-
-        return labels
+    def fork(self, labels=None):
+        """
+        Clone the interpreter in its current state, e.g. after running code
+        several checks have in common. Following interpret calls of the clone
+        continue from that state. The memory image is only read while
+        running, so it's shared instead of copied.
+        :param labels: labels the clone refers to instead, e.g. the labels of
+        the whole file or other label values
+        :return: AsmInterpreter
+        """
+        clone = copy.copy(self)
+        clone.regs = self.regs.copy()
+        clone.stack = list(self.stack)
+        clone.calls = list(self.calls)
+        clone.interrupts = list(self.interrupts)
+        clone.loaded_tables = list(self.loaded_tables)
+        clone.tables = dict(self.tables)
+        if labels is not None:
+            clone.labels = labels
+        else:
+            # assembled once for both
+            clone.image = self.image
+        return clone
+
+    def _image(self, lines):
+        # parts of the code are assembled on their own, the remaining labels
+        # refer to the whole code
+        return self.image if lines is None else assemble(lines, self.labels)
+
+    def descriptor_table(self, cmd="lgdt"):
+        """
+        Decode the descriptor table loaded by lgdt or lidt from memory
+        :return: DescriptorTable or None if no table was loaded
+        """
+        pseudo_descr = self.tables.get(cmd)
+        if pseudo_descr is None:
+            return None
+        limit, base = pseudo_descr
+        return decode_descriptor_table(self.image.read(base, limit + 1),
+                                       cmd == "lgdt")
 
     def interpret(self, lines=None):
         if lines is None:
-            lines = self.lines
-
-        for l in lines:
-            cmd, params = _tokenize_line(l)
-            fn = self._get_function(cmd)
-            if fn:
-                res = fn(params)
-            else:
-                logging.warning("Didn't handle line '{}'".format(l))
-            pass
+            if self._program is None:
+                self._program = decode(self.lines)
+            program = self._program
+        else:
+            program = decode(lines)
 
+        self._run(program)
         return self.regs
 
+    def _run(self, program):
+        self._running = program
+        self.pc = 0
+        self.steps = 0
+        self.exhausted = False
+        end = len(program)
+        tracer = self.tracer
+        while self.pc < end:
+            if self.steps >= self.max_steps:
+                logging.warning("stopped execution after {} steps"
+                                .format(self.steps))
+                self.exhausted = True
+                break
+
+            ins = program[self.pc]
+            self.pc += 1
+            self.steps += 1
+            if tracer is None:
+                ins.handler(self, ins)
+            else:
+                state = tracer.before(self, ins)
+                ins.handler(self, ins)
+                tracer.after(self, ins, state)
+
     def parse_segment_descriptors(self, lines=None):
-        if lines is None:
-            lines = self.lines
-
-        segments = {}
-        seg_bytes = []
-        seg_name = None
-        for l in lines:
-            l = _strip_line(l)
-            if "equ $-gdt" in l:
-                if seg_name:
-                    segments[seg_name] = _parse_descriptor_defines(
-                        seg_bytes, self.labels)
-                seg_name = l[:l.index(" ")]
-                seg_bytes.clear()
-            elif "gdt_end:" in l:
-                segments[seg_name] = _parse_descriptor_defines(
-                    seg_bytes, self.labels)
-            elif seg_name:
-                seg_bytes.append(l)
-
-        for k, v in segments.items():
-            segments[k] = _parse_segment_descriptor(v)
-
-        return segments
+        image = self._image(lines)
+
+        # every segment selector is defined as equ $-gdt, the segment reaches
+        # up to the next selector or the end of the table
+        selectors = [(name, here) for name, (expr, here)
+                     in image.equates.items()
+                     if expr.replace(' ', '') == "$-gdt"]
+        ends = [here for _, here in selectors[1:]]
+        if "gdt_end" in image.labels:
+            ends.append(image.labels["gdt_end"])
+
+        # decode all segments at once, a segment with more than one
+        # descriptor can't be unpacked and is decoded as zeros
+        buf = bytearray()
+        for (name, start), end in zip(selectors, ends):
+            v = image.read(start, end - start)
+            if len(v) > 8:
+                logging.error("Couldn't unpack segment descriptor {}, because"
+                              " it has {} bytes".format(name, len(v)))
+                v = bytes(8)
+            buf += v
+            buf += b'\xff' * (8 - len(v))
+
+        return dict(zip((name for name, _ in selectors),
+                        decode_descriptor_table(buf)))
 
     def parse_descriptors(self, lines=None, is_seg_descriptor=True):
-        if lines is None:
-            lines = self.lines
-
-        descr_lines = []
-        is_define_cmd = False
-        for l in lines:
-            if "idt:" in l:
-                is_define_cmd = True
-            elif "idt_end:" in l:
-                break
-            elif is_define_cmd:
-                descr_lines.append(l)
-
-        descrbytes = _parse_descriptor_defines(descr_lines, self.labels)
-        bytes_per_entry = 8
-        entries = [descrbytes[x:x + bytes_per_entry] for x in
-                   range(0, len(descrbytes), bytes_per_entry)]
+        image = self._image(lines)
 
-        parser = (_parse_segment_descriptor if is_seg_descriptor
-                  else _parse_interrupt_descriptor)
+        start = image.labels.get("idt")
+        if start is None:
+            return []
+        end = image.labels.get("idt_end", image.origin + len(image.data))
 
-        return [parser(bs) for bs in entries]
+        return list(decode_descriptor_table(image.read(start, end - start),
+                                            is_seg_descriptor))
 
     def get_register(self, reg_name):
         return self.regs[reg_name]
@@ -354,9 +1121,10 @@ class AsmInterpreter:
     def _write_register(self, reg, value):
         pass
 
-    def _is_register(self, name):
+    @staticmethod
+    def _is_register(name):
         name = name.lower()
-        if len(name) == 3 and name in self.regs:
+        if len(name) == 3 and name in Registers._names:
             return True
         elif len(name) == 2:
             if name[1] in ['x', 'h', 'l'] and name[0] in ['a', 'b', 'c', 'd']:
@@ -366,75 +1134,335 @@ class AsmInterpreter:
 
         return False
 
-    def _resolve_value(self, src):
+    def _operand_value(self, opnd):
+        kind, val = opnd
+        if kind == OPND_IMM:
+            return val
+        elif kind == OPND_REG:
+            return self.regs.read(val)
+        return _label_value(kind, val, self.labels)
+
+    def _set_flags(self, key, res, carry=False):
+        self.regs.write(_eflags, _update_flags(self.regs.read(_eflags), res,
+                                               key[1], carry))
+
+    def _arith(self, ins, fn, carry_fn=None):
+        dst, src = ins.operands
+        a, b = self.regs.read(dst.value), self._operand_value(src)
+        res = fn(a, b)
+        self.regs.write(dst.value, res)
+        self._set_flags(dst.value, res,
+                        carry_fn(a, b, dst.value[1]) if carry_fn else False)
+
+    def _jump(self, target):
+        idx = self._running.targets.get(target)
+        if idx is None:
+            # target outside of the executed code
+            self.pc = len(self._running)
+        else:
+            self.pc = idx
+
+    def _exec_mov(self, ins):
+        dst, src = ins.operands
+        # TODO handle [] operations as well as different opsizes
+        self.regs.write(dst.value, self._operand_value(src))
+
+    def _exec_or(self, ins):
+        self._arith(ins, *_alu_ops["or"])
+
+    def _exec_and(self, ins):
+        self._arith(ins, *_alu_ops["and"])
+
+    def _exec_xor(self, ins):
+        self._arith(ins, *_alu_ops["xor"])
+
+    def _exec_add(self, ins):
+        self._arith(ins, *_alu_ops["add"])
+
+    def _exec_sub(self, ins):
+        self._arith(ins, *_alu_ops["sub"])
+
+    def _exec_cmp(self, ins):
+        a, b = ins.operands
+        mask = a.value[1] if a.kind == OPND_REG else 0xffffffff
+        a, b = self._operand_value(a), self._operand_value(b)
+        self._set_flags((None, mask), a - b, (a & mask) < (b & mask))
+
+    def _exec_inc(self, ins):
+        dst, = ins.operands
+        res = self.regs.read(dst.value) + 1
+        self.regs.write(dst.value, res)
+        self._set_flags(dst.value, res, self.regs.read(_eflags) & self.CF)
+
+    def _exec_dec(self, ins):
+        dst, = ins.operands
+        res = self.regs.read(dst.value) - 1
+        self.regs.write(dst.value, res)
+        self._set_flags(dst.value, res, self.regs.read(_eflags) & self.CF)
+
+    # like x86, only the low 5 bits of the shift count are used
+    def _exec_shl(self, ins):
+        self._arith(ins, lambda a, b: a << (b & 0x1f),
+                    lambda a, b, mask: (b & 0x1f) and
+                    (a << ((b & 0x1f) - 1)) & ~(mask >> 1))
+
+    def _exec_shr(self, ins):
+        self._arith(ins, lambda a, b: a >> (b & 0x1f),
+                    lambda a, b, mask: (b & 0x1f) and
+                    (a >> ((b & 0x1f) - 1)) & 1)
+
+    def _push(self, val):
+        self.stack.append(val)
+        self.regs.write(_esp, self.regs.read(_esp) - 4)
+
+    def _pop(self):
+        if not self.stack:
+            logging.warning("pop from empty stack")
+            return None
+        self.regs.write(_esp, self.regs.read(_esp) + 4)
+        return self.stack.pop()
+
+    def _exec_push(self, ins):
+        self._push(self._operand_value(ins.operands[0]))
+
+    def _exec_pop(self, ins):
+        val = self._pop()
+        self.regs.write(ins.operands[0].value, val or 0)
+
+    def _exec_jmp(self, ins):
+        self._jump(ins.operands[0].value)
+
+    def _exec_jcc(self, ins):
+        cond = self.conditions[self.mnemonics[ins.opcode]]
+        if cond(self.regs.read(_eflags)):
+            self._jump(ins.operands[0].value)
+
+    def _exec_loop(self, ins):
+        count = self.regs.read(_ecx) - 1
+        self.regs.write(_ecx, count)
+        if count & 0xffffffff:
+            self._jump(ins.operands[0].value)
+
+    def _exec_call(self, ins):
+        target = ins.operands[0].value
+        self.calls.append(target)
+        if target in self._running.targets:
+            self._push(self.pc)
+            self._jump(target)
+
+    def _exec_ret(self, ins):
+        ret = self._pop()
+        if ret is not None and 0 <= ret < len(self._running):
+            self.pc = ret
+            return
+
+        if ret is not None:
+            logging.warning("return to invalid address {}".format(ret))
+        # returning from the executed code stops it
+        self.pc = len(self._running)
+
+    def _exec_int(self, ins):
+        self.interrupts.append(self._operand_value(ins.operands[0]))
+
+    def _exec_load_table(self, ins):
+        cmd, operand = self.mnemonics[ins.opcode], ins.operands[0].value
+        self.loaded_tables.append((cmd, operand))
         try:
-            if any((c in '+-*/') for c in src):
-                try:
-                    val = eval(src)
-                except Exception as e:
-                    logging.warning("couldn't evaluate expression '{}'"
-                                    .format(src))
-                    val = _parse_number(src)
-            else:
-                val = _parse_number(src)
-        except ValueError:  # src is no value
-            if self._is_register(src):
-                val = self.regs[src]
-            elif src in self.labels:
-                val = self.labels[src]
-            else:
-                logging.warning("Invalid source value: {}".format(src))
-                val = 0
-                # val = self.regs[src] if self._is_register(src) else src
-        return val
+            addr = evaluate(operand, self.labels)
+        except ExpressionError as e:
+            logging.warning("Can't load descriptor table: {}".format(e))
+            return
+        pseudo_descr = self.image.unpack("<HI", addr)
+        if pseudo_descr is not None:
+            self.tables[cmd] = pseudo_descr
+
+    def _exec_nop(self, ins):
+        pass
 
-    def _get_function(self, cmd):
-        cmd = cmd.lower()
-        if cmd == "mov":
-            return self._move
-        elif cmd == "or":
-            return self._or
-        # elif cmd in ["jmp", "jz", "jnz", "jne" "jgt"]:
-        #     pass
-        # elif cmd == "int":
-        #     pass
-        # elif cmd == "call":
-        #     pass
-        # elif cmd == ["retn", "iret"]:
-        #     pass
-        # elif cmd == "cmp":
-        #     pass
-        # elif cmd == "dec":
-        #     pass
-        # elif cmd == "inc":
-        #     pass
-        # elif cmd == "push":
-        #     pass
-        # elif cmd == "pop":
-        #     pass
-        # elif cmd == "shl":
-        #     pass
-        else:
-            logging.warning("Command '{}' not recognized!".format(cmd))
+    def _exec_hlt(self, ins):
+        self.pc = len(self._running)
+
+    def _execute(self, cmd, params):
+        ins = decode_line("{} {}".format(cmd, ", ".join(params)))
+        if ins:
+            ins.handler(self, ins)
 
     def _move(self, params):
-        if len(params) > 2:
-            opsize, dst, src = params[0], params[1], params[2]
-        else:
-            dst, src = params[0], params[1]
-            opsize = _determine_opsize(dst, src)
+        self._execute("mov", params)
 
-        # TODO handle [] operations as well as different opsizes
-        val = self._resolve_value(src)
+    def _or(self, params):
+        self._execute("or", params)
+
+
+# instructions without control flow or side effects, which run_batch
+# executes in lockstep for many register files
+_lockstep_ops = frozenset(list(_alu_ops) + ["mov", "cli", "sti", "nop"])
 
-        if len(params) <= 3:
-            self.regs[dst] = val
+
+def _vmap(fn, *args):
+    # apply fn elementwise, numpy arrays are handled by fn itself
+    if numpy is not None:
+        return fn(*args)
+    cols = [a if isinstance(a, list) else itertools.repeat(a) for a in args]
+    return [fn(*vals) for vals in zip(*cols)]
+
+
+class RegisterBatch:
+    """
+    Register files of many interpreters as one matrix with a row per
+    interpreter, a numpy array if available and a list of rows otherwise
+    """
+    def __init__(self, count):
+        width = len(Registers._names)
+        if numpy is not None:
+            self.slots = numpy.zeros((count, width), dtype=numpy.int64)
         else:
-            logging.warning("--- strange move cmd: mov {}"
-                            .format(' '.join(params)))
+            self.slots = [[0] * width for _ in range(count)]
 
-    def _or(self, params):
-        dst, src = params[0], params[1]
-        val = self._resolve_value(src)
+    def __len__(self):
+        return len(self.slots)
+
+    @classmethod
+    def from_registers(cls, regs):
+        batch = cls(len(regs))
+        for nr, r in enumerate(regs):
+            batch.set_row(nr, r)
+        return batch
+
+    def set_row(self, nr, regs):
+        self.slots[nr][:] = regs._slots
+
+    def row(self, nr):
+        """
+        :return: Registers of a single interpreter
+        """
+        regs = Registers()
+        regs._slots = [int(v) for v in self.slots[nr]]
+        return regs
 
-        self.regs[dst] |= val
+    def vector(self, values):
+        """
+        :return: per row values in the representation of the columns
+        """
+        values = [v & 0xffffffff for v in values]
+        if numpy is not None:
+            return numpy.array(values, dtype=numpy.int64)
+        return values
+
+    def read(self, key, rows=None):
+        """
+        Read a register of all (or the given) rows
+        :param key: key of the register, see Registers.get_reg_key
+        :param rows: row numbers, all rows if None
+        :return: column of values
+        """
+        slot, mask, shift = key
+        if numpy is not None:
+            col = self.slots[:, slot] if rows is None else self.slots[rows,
+                                                                        slot]
+            return (col >> shift) & mask
+        rows = range(len(self.slots)) if rows is None else rows
+        return [(self.slots[r][slot] >> shift) & mask for r in rows]
+
+    def write(self, key, values, rows):
+        slot, mask, shift = key
+        if numpy is not None:
+            cur = self.slots[rows, slot]
+            self.slots[rows, slot] = ((cur & ~(mask << shift)) |
+                                      ((values & mask) << shift))
+            return
+        if not isinstance(values, list):
+            values = itertools.repeat(values)
+        for r, val in zip(rows, values):
+            cur = self.slots[r][slot]
+            self.slots[r][slot] = ((cur & ~(mask << shift)) |
+                                   ((val & mask) << shift))
+
+    def column(self, reg):
+        """
+        :param reg: name of the register
+        :return: values of the register of all rows
+        """
+        return self.read(_reg_aliases[reg.lower()])
+
+
+def _is_lockstep(program):
+    return all(AsmInterpreter.mnemonics[ins.opcode] in _lockstep_ops
+               for ins in program)
+
+
+def _batch_operand(batch, opnd, rows, labels):
+    kind, val = opnd
+    if kind == OPND_IMM:
+        return val & 0xffffffff
+    elif kind == OPND_REG:
+        return batch.read(val, rows)
+
+    # labels differ between the interpreters
+    return batch.vector([_label_value(kind, val, labels[r]) for r in rows])
+
+
+def _run_lockstep(batch, ins, rows, labels):
+    cmd = AsmInterpreter.mnemonics[ins.opcode]
+    if cmd not in _alu_ops and cmd != "mov":
+        # cli, sti, nop
+        return
+
+    dst, src = ins.operands
+    if numpy is not None:
+        rows = numpy.asarray(rows)
+    b = _batch_operand(batch, src, rows, labels)
+    if cmd == "mov":
+        batch.write(dst.value, b, rows)
+        return
+
+    fn, carry_fn = _alu_ops[cmd]
+    mask = dst.value[1]
+    a = batch.read(dst.value, rows)
+    res = _vmap(fn, a, b)
+    batch.write(dst.value, res, rows)
+
+    carry = _vmap(carry_fn, a, b, mask) if carry_fn else False
+    batch.write(_eflags, _vmap(_update_flags, batch.read(_eflags, rows),
+                               res, mask, carry), rows)
+
+
+def run_batch(programs, labels=None, starts=None):
+    """
+    Run many decoded programs at once, each on its own register file.
+    Straight-line programs advance in lockstep: every distinct instruction
+    of a step runs once for all programs sharing it. Programs with control
+    flow or side effects run one by one with an AsmInterpreter.
+    :param programs: Programs, see decode
+    :param labels: list with the labels of every program
+    :param starts: list with the AsmInterpreter every program continues
+    from, see AsmInterpreter.fork, programs start from zeroed registers if
+    None
+    :return: RegisterBatch with a row per program
+    """
+    labels = labels if labels is not None else [{}] * len(programs)
+    batch = RegisterBatch(len(programs))
+
+    lockstep = []
+    for nr, program in enumerate(programs):
+        start = starts[nr] if starts is not None else None
+        if _is_lockstep(program):
+            lockstep.append(nr)
+            if start is not None:
+                batch.set_row(nr, start.regs)
+        else:
+            asm = (AsmInterpreter((), labels[nr]) if start is None
+                   else start.fork(labels[nr]))
+            asm._run(program)
+            batch.set_row(nr, asm.regs)
+
+    for step in range(max((len(programs[nr]) for nr in lockstep),
+                          default=0)):
+        groups = collections.OrderedDict()
+        for nr in lockstep:
+            if step < len(programs[nr]):
+                groups.setdefault(programs[nr][step], []).append(nr)
+        for ins, rows in groups.items():
+            _run_lockstep(batch, ins, rows, labels)
+
+    return batch
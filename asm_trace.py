@@ -0,0 +1,57 @@
+import collections
+
+from asm_interpreter import AsmInterpreter, Registers
+
+# executed instruction with the registers it changed as (name, old, new)
+TraceEntry = collections.namedtuple("TraceEntry", "step pc cmd line diff")
+
+
+class Tracer:
+    """
+    Instrumentation of AsmInterpreter runs. The interpreter calls the tracer
+    around every instruction, which counts the executed opcodes and keeps
+    the last instructions with their register changes for a post-mortem.
+    """
+    def __init__(self, history=16, callback=None):
+        """
+        :param history: number of instructions kept
+        :param callback: called with the interpreter and the TraceEntry of
+        every executed instruction
+        """
+        self.counts = collections.Counter()
+        self.history = collections.deque(maxlen=history)
+        self.callback = callback
+
+    def before(self, asm, ins):
+        # position and registers before the instruction, passed back to
+        # after, pc already points to the next instruction
+        return asm.pc - 1, list(asm.regs._slots)
+
+    def after(self, asm, ins, state):
+        pc, prev = state
+        cmd = AsmInterpreter.mnemonics[ins.opcode]
+        self.counts[cmd] += 1
+
+        diff = tuple((Registers._names[slot], old, new) for slot, (old, new)
+                     in enumerate(zip(prev, asm.regs._slots)) if old != new)
+        entry = TraceEntry(asm.steps, pc, cmd, ins.line, diff)
+        self.history.append(entry)
+        if self.callback is not None:
+            self.callback(asm, entry)
+
+    def clear(self):
+        self.counts.clear()
+        self.history.clear()
+
+    def format_history(self):
+        """
+        :return: list of lines describing the last executed instructions
+        """
+        res = []
+        for entry in self.history:
+            changes = ", ".join("{} {:#x} -> {:#x}".format(*d)
+                                for d in entry.diff)
+            res.append("#{} {}{}".format(entry.step, entry.line,
+                                         "  ({})".format(changes)
+                                         if changes else ""))
+        return res
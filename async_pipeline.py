@@ -0,0 +1,97 @@
+"""
+asyncio pipeline which overlaps reading the submissions, grading them and
+writing the results. Reading and writing run in a thread, grading in a
+process pool, and the stages are connected by bounded queues, so memory
+stays bounded no matter how large the archive is.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# marks the end of the jobs in a queue
+_done = object()
+
+
+async def _read(jobs, queue, io_pool, graders):
+    loop = asyncio.get_running_loop()
+    it = iter(jobs)
+    while True:
+        # reading and decompressing may block, keep it off the event loop
+        job = await loop.run_in_executor(io_pool, next, it, _done)
+        if job is _done:
+            break
+        await queue.put(job)
+
+    for _ in range(graders):
+        await queue.put(_done)
+
+
+async def _grade(job_fn, jobs, results, pool):
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await jobs.get()
+        if job is _done:
+            await results.put(_done)
+            return
+        await results.put(await loop.run_in_executor(pool, job_fn, *job))
+
+
+async def _write(write_fn, results, io_pool, graders):
+    loop = asyncio.get_running_loop()
+    count = 0
+    while graders:
+        res = await results.get()
+        if res is _done:
+            graders -= 1
+            continue
+        await loop.run_in_executor(io_pool, write_fn, res)
+        count += 1
+    return count
+
+
+async def _run(jobs, job_fn, write_fn, workers, queue_size, initializer,
+               initargs):
+    # one grader per pending job, so every worker has a job to work on
+    # while the result of the previous one is transferred
+    graders = workers * 2
+    queue_size = queue_size or graders
+    job_queue = asyncio.Queue(maxsize=queue_size)
+    result_queue = asyncio.Queue(maxsize=queue_size)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             initargs=initargs) as pool, \
+            ThreadPoolExecutor(max_workers=2) as io_pool:
+        tasks = [asyncio.ensure_future(_read(jobs, job_queue, io_pool,
+                                             graders)),
+                 asyncio.ensure_future(_write(write_fn, result_queue,
+                                              io_pool, graders))]
+        tasks += [asyncio.ensure_future(_grade(job_fn, job_queue,
+                                               result_queue, pool))
+                  for _ in range(graders)]
+        try:
+            res = await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
+
+    return res[1]
+
+
+def run(jobs, job_fn, write_fn, workers=1, queue_size=None,
+        initializer=None, initargs=()):
+    """
+    Run all jobs through the pipeline
+    :param jobs: iterable of argument tuples of job_fn, which is consumed in
+    a thread
+    :param job_fn: picklable function which is run in a worker process
+    :param write_fn: function which is called in a thread with the result
+    of every job, in the order the jobs finish
+    :param workers: number of worker processes
+    :param queue_size: max. number of jobs and results waiting between the
+    stages, defaults to twice the number of workers
+    :param initializer: function which initializes each worker process
+    :param initargs: arguments of the initializer
+    :return: number of written results
+    """
+    return asyncio.run(_run(jobs, job_fn, write_fn, max(1, workers),
+                            queue_size, initializer, initargs))
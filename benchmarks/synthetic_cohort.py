@@ -0,0 +1,229 @@
+"""
+Generate synthetic submission archives in the layout of the real ones
+(one folder per student with the generated suffix, containing the nested
+submission zip), so the pipeline can be benchmarked without student data.
+"""
+import io
+import os
+import random
+from zipfile import ZipFile, ZIP_DEFLATED
+
+first_names = ["Anna", "Bernd", "Clara", "David", "Eva", "Florian", "Gerda",
+               "Hannes", "Ines", "Jakob", "Katrin", "Lukas", "Maria", "Nico"]
+last_names = ["Auer", "Berger", "Gruber", "Huber", "Koller", "Mayr", "Moser",
+              "Pichler", "Reiter", "Steiner", "Wagner", "Wimmer", "Wolf"]
+
+segment_template = """{name} equ $-gdt
+\tdw {limit}\t\t; limit 0-15
+\tdw 0x{base_lo:04X}\t\t; base 0-15
+\tdb 0x{base_mid:02X}\t\t; base 16-23
+\tdb {access:08b}b\t; P, DPL, S, type
+\tdb {flags:08b}b\t; G, D/B, L, AVL, limit 16-19
+\tdb 0x00\t\t; base 24-31
+"""
+
+source_template = """; Uebung 3 - protected mode
+[bits 16]
+[org 0x7c00]
+
+start:
+\tcli
+\txor ax, ax
+\tmov ds, ax
+\tlgdt [gdtr]
+
+; <AUFGABE2>
+\tmov eax, cr0
+\tor al, {pe_bit}\t\t; set PE bit
+\tmov cr0, eax
+; </AUFGABE2>
+
+\tjmp code:pmode
+
+[bits 32]
+pmode:
+; <AUFGABE3>
+\tmov ax, data
+\tmov ds, ax
+\tmov ss, ax
+\tmov ax, {extra_seg}
+\tmov es, ax
+\tmov ax, 0
+\tmov fs, ax
+\tmov gs, ax
+\tmov esp, {stack}
+; </AUFGABE3>
+
+; <AUFGABE5>
+{lidt}
+\tsti
+\tint {int1}
+; </AUFGABE5>
+
+; <AUFGABE7>
+{paging}
+\tint {int2}
+; </AUFGABE7>
+
+hang:
+\tjmp hang
+
+interrupthandler1:
+\tmov byte [es:0], 'A'
+\tiret
+
+interrupthandler2:
+\tmov byte [es:2], 'B'
+\tiret
+
+startpaging:
+\tmov eax, 0x9C000
+\tmov cr3, eax
+\tmov eax, cr0
+\tor eax, 0x80000000
+\tmov cr0, eax
+\tret
+
+; <AUFGABE1>
+gdt:
+\tdd 0, 0\t\t\t; null descriptor
+{segments}gdt_end:
+; </AUFGABE1>
+
+gdtr:
+\tdw gdt_end - gdt - 1
+\tdd gdt
+
+; <AUFGABE4>
+idtr:
+\tdw idt_end - idt - 1
+\tdd idt
+idt:
+\tdd 0, 0
+\tdw interrupthandler1
+\tdw code
+\tdb 0x00
+\tdb {gate:08b}b
+\tdw 0x00
+\tdw interrupthandler2
+\tdw code
+\tdb 0x00
+\tdb {gate:08b}b
+\tdw 0x80
+idt_end:
+; </AUFGABE4>
+
+\ttimes 510-($-$$) db 0
+\tdw 0xAA55
+"""
+
+
+def _maybe(rnd, rate, mistake, correct):
+    return mistake if rnd.random() < rate else correct
+
+
+def _segment(rnd, name, limit, base, seg_type, granular, rate):
+    access = 0x90 | _maybe(rnd, rate, rnd.choice([0, 1, 4, 8]), seg_type)
+    access |= _maybe(rnd, rate, 0x60, 0)  # dpl
+    flags = (0x40 | (0x80 if granular else 0)) ^ _maybe(rnd, rate, 0x80, 0)
+    return segment_template.format(
+        name=name,
+        limit=_maybe(rnd, rate, hex(limit + rnd.randint(2, 100)), hex(limit)),
+        base_lo=base & 0xffff,
+        base_mid=_maybe(rnd, rate, 0x0C, (base >> 16) & 0xff),
+        access=access,
+        flags=flags)
+
+
+def generate_source(rnd, mistake_rate=0.1):
+    """
+    Generate the source of a submission
+    :param rnd: random.Random used to pick the mistakes
+    :param mistake_rate: probability of each single mistake
+    :return: source code as string
+    """
+    rate = mistake_rate
+    segments = "".join([
+        _segment(rnd, "code", 0x0BFF, 0, rnd.choice([10, 11, 14, 15]), True,
+                 rate),
+        _segment(rnd, "data", 0x0BFF, 0, rnd.choice([2, 3]), True, rate),
+        _segment(rnd, "video", 0x7FFF, 0xB8000, 2, False, rate)])
+
+    src = source_template.format(
+        pe_bit=_maybe(rnd, rate, "0x02", rnd.choice(["0x01", "1", "1b"])),
+        extra_seg=_maybe(rnd, rate, "data", "video"),
+        stack=_maybe(rnd, rate, "0xBFFFF0", "0xBFFFFF"),
+        lidt=_maybe(rnd, rate, "", "\tlidt [idtr]"),
+        int1=_maybe(rnd, rate, "3", "1"),
+        paging=_maybe(rnd, rate, "", "\tcall startpaging"),
+        int2=_maybe(rnd, rate, "0x20", "2"),
+        segments=segments,
+        gate=_maybe(rnd, rate, 0x8F, 0x8E))
+
+    # students comment and indent differently
+    if rnd.random() < 0.5:
+        src = src.replace("\t", "    ")
+    if rnd.random() < 0.3:
+        src = src.replace("\n", "\r\n")
+    return src
+
+
+def _student_name(rnd, nr):
+    return "{} {} {}".format(rnd.choice(first_names),
+                             rnd.choice(last_names), nr)
+
+
+def _submission_zip(rnd, src):
+    buf = io.BytesIO()
+    with ZipFile(buf, "w", ZIP_DEFLATED) as sub:
+        prefix = rnd.choice(["", "ue3/", "BSY1UE3/"])
+        asm_name = rnd.choice(["protected.asm", "protected.asm", "ue3.asm"])
+        sub.writestr(prefix + asm_name, src)
+        if rnd.random() < 0.5:
+            sub.writestr(prefix + "Makefile", "all:\n\tnasm protected.asm\n")
+        if rnd.random() < 0.5:
+            sub.writestr(prefix + "write.c", "int main() { return 0; }\n")
+    return buf.getvalue()
+
+
+def generate_cohort(dst, count, seed=0, mistake_rate=0.1):
+    """
+    Write an archive with the given number of synthetic submissions
+    :param dst: path or file object of the archive
+    :param count: number of submissions
+    :param seed: seed of the random generator, so cohorts are reproducible
+    :param mistake_rate: probability of each single mistake
+    :return: list of the generated student names
+    """
+    rnd = random.Random(seed)
+    students = []
+    with ZipFile(dst, "w", ZIP_DEFLATED) as subs:
+        for nr in range(count):
+            student = _student_name(rnd, nr)
+            students.append(student)
+            folder = "{}_{}_assignsubmission_file_".format(
+                student, rnd.randint(100000, 999999))
+
+            src = generate_source(rnd, mistake_rate)
+            if rnd.random() < 0.1:
+                # plain source without a nested zip
+                subs.writestr(folder + "/protected.asm", src)
+            else:
+                subs.writestr(folder + "/submission.zip",
+                              _submission_zip(rnd, src))
+
+    return students
+
+
+def write_reference_files(dst_dir):
+    """
+    Write stand-ins for the reference Makefile and write.c
+    :return: 2-tuple of the paths of the Makefile and write.c
+    """
+    makefile = os.path.join(dst_dir, "Makefile_3")
+    write = os.path.join(dst_dir, "write_3.c")
+    with open(makefile, "w") as f:
+        f.write("all:\n\tnasm protected.asm\n")
+    with open(write, "w") as f:
+        f.write("int main() { return 0; }\n")
+    return makefile, write
@@ -0,0 +1,115 @@
+"""
+End-to-end throughput benchmark of handle_submissions on synthetic cohorts
+
+    python -m benchmarks.throughput --sizes 100 1000 10000 --workers 4
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+from benchmarks.synthetic_cohort import generate_cohort, write_reference_files
+
+
+def _peak_rss_mb():
+    # ru_maxrss is given in kilobytes on linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, workers) / 1024
+
+
+def _run(conn, archive, wd, workers, in_memory):
+    # runs in a fresh process, so the peak memory belongs to this size only
+    import main
+    import exc3_protected
+
+    exc3_protected.makefile_src, exc3_protected.write_src = (
+        write_reference_files(wd))
+    main.output_dir = os.path.join(wd, "out")
+
+    start = time.perf_counter()
+    grades = main.handle_submissions(archive, workers=workers,
+                                     in_memory=in_memory)
+    elapsed = time.perf_counter() - start
+
+    conn.send((len(grades), elapsed, _peak_rss_mb()))
+    conn.close()
+
+
+def bench(size, workers=1, in_memory=False, seed=0):
+    """
+    Grade a synthetic cohort of the given size
+    :return: dict with the number of graded submissions, the elapsed time,
+    the throughput and the peak memory of the grading process
+    """
+    wd = tempfile.mkdtemp(prefix="tutgrader_bench_")
+    try:
+        archive = os.path.join(wd, "subs.zip")
+        generate_cohort(archive, size, seed=seed)
+
+        parent, child = multiprocessing.Pipe(duplex=False)
+        proc = multiprocessing.Process(
+            target=_run, args=(child, archive, wd, workers, in_memory))
+        proc.start()
+        # only the child may keep its end open, otherwise recv never sees
+        # the end of the pipe if the child dies
+        child.close()
+        try:
+            graded, elapsed, peak_mb = parent.recv()
+        except EOFError:
+            proc.join()
+            raise RuntimeError("grading {} submissions failed with exit code "
+                               "{}".format(size, proc.exitcode))
+        finally:
+            parent.close()
+        proc.join()
+    finally:
+        shutil.rmtree(wd)
+
+    return {
+        "size": size,
+        "workers": workers,
+        "in_memory": in_memory,
+        "graded": graded,
+        "seconds": elapsed,
+        "submissions_per_second": graded / elapsed if elapsed else 0,
+        "peak_rss_mb": peak_mb
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[100, 1000, 10000])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--in-memory", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON lines")
+    args = parser.parse_args(argv)
+
+    # the grader logs every unhandled line, keep that out of the numbers
+    logging.disable(logging.CRITICAL)
+
+    if not args.json:
+        print("{:>8} {:>8} {:>10} {:>10} {:>10}".format(
+            "size", "workers", "seconds", "subs/s", "peak MB"))
+    for size in args.sizes:
+        res = bench(size, args.workers, args.in_memory, args.seed)
+        if args.json:
+            print(json.dumps(res))
+        else:
+            print("{size:>8} {workers:>8} {seconds:>10.2f} "
+                  "{submissions_per_second:>10.1f} {peak_rss_mb:>10.1f}"
+                  .format(**res))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
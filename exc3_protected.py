@@ -1,161 +1,89 @@
 import os
 import logging
 import shutil
+import collections
 import functools
 # from functools import partial
 
-from asm_interpreter import AsmInterpreter, _parse_number, _tokenize_line
-
-makefile_src = os.path.join("..", "data", "Makefile_3")
-write_src = os.path.join("..", "data", "write_3.c")
-
-
-def _eval_segment(seg, criteria, deduct):
-    explanations = {
-        "seglimit": "Falsches Segmentlimit: {}",
-        "base_addr": "Falsche Basisadresse: {}",
-        "type": "Falscher Segment Typ (type): {}",
-        "s": "Falscher Descriptor Typ (s): {}",
-        "dpl": "Falsches Privileg Level (dpl): {}",
-        "p": "Segment muss praesent sein (p)",
-        "avl": "Segment steht nicht fuer das System zur Verfuegung",
-        "l": "Es handelt sich nicht um ein 64 Bit Segment (l)",
-        "db": "Operation Size muss 32 Bit sein (db)",
-        "g": "Granularität Bit muss gesetzt sein (g)"
-    }
-
-    for k, v in seg.items():
-        if not criteria[k](v):
-            deduct(1, explanations[k].format(v))
+from asm_interpreter import AsmInterpreter, _parse_number, _tokenize_line, \
+    tokenize, assemble, decode, run_batch, _vmap, OPND_LABEL, OPND_EXPR
+from asm_trace import Tracer
+from task_index import TaskIndex
+import rubric
+import timing
+from task_memo import task_memo
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+makefile_src = os.path.join(data_dir, "Makefile_3")
+write_src = os.path.join(data_dir, "write_3.c")
+
+
+def _share_file(src, dst):
+    # the reference files are only read, so every submission can share
+    # them instead of getting its own copy
+    for link in (os.link, os.symlink):
+        try:
+            link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def _is_shared(src, dst):
+    return os.path.islink(dst) or (os.path.exists(src) and
+                                   os.path.samefile(src, dst))
+
+
+def _segment_rubric(seglimit, base_addr, types, granularity):
+    """
+    :param seglimit: (min, max) of the segment limit
+    :param base_addr: base address of the segment
+    :param types: allowed segment types
+    :param granularity: whether the granularity bit has to be set
+    :return: Rubric of a segment descriptor
+    """
+    return rubric.Rubric([
+        ("seglimit", rubric.between(*seglimit), 1,
+         "Falsches Segmentlimit: {}"),
+        ("base_addr", rubric.equals(base_addr), 1,
+         "Falsche Basisadresse: {}"),
+        ("type", rubric.one_of(*types), 1, "Falscher Segment Typ (type): {}"),
+        ("s", rubric.is_set, 1, "Falscher Descriptor Typ (s): {}"),
+        ("dpl", rubric.at_most(1), 1, "Falsches Privileg Level (dpl): {}"),
+        ("p", rubric.is_set, 1, "Segment muss praesent sein (p)"),
+        ("avl", rubric.not_set, 1,
+         "Segment steht nicht fuer das System zur Verfuegung"),
+        ("l", rubric.not_set, 1,
+         "Es handelt sich nicht um ein 64 Bit Segment (l)"),
+        ("db", rubric.is_set, 1, "Operation Size muss 32 Bit sein (db)"),
+        ("g", rubric.is_set, 1, "Granularität Bit muss gesetzt sein (g)")
+        if granularity else
+        ("g", rubric.not_set, 1,
+         "Granularität Bit darf nicht gesetzt sein (g)"),
+    ])
+
+
+_code_seg_rubric = _segment_rubric((3071, 3072), 0, (10, 11, 14, 15), True)
+_data_seg_rubric = _segment_rubric((3071, 3072), 0, (2, 3), True)
+_video_seg_rubric = _segment_rubric((0x7FFF, 0x8000), 0xB8000, (2, 3), False)
 
 
 def _eval_code_seg(seg, deduct_fn):
-    # deduced_pts = 0
-    # penalties = []
-
-    criteria = {
-        "seglimit": lambda x: 3071 <= x <= 3072,
-        "base_addr": lambda x: x == 0,
-        "type": lambda x: x in [10, 11, 14, 15],
-        "s": lambda x: x,
-        "dpl": lambda x: x <= 1,
-        "p": lambda x: x,
-        "avl": lambda x: not x,
-        "l": lambda x: not x,
-        "db": lambda x: x,
-        "g": lambda x: x
-    }
-
-    _eval_segment(seg, criteria, deduct_fn)
-
-    # if not (3071 <= seg["seglimit"] <= 3072):
-    #     deduced_pts += 1
-    #     penalties.append("Falsches Segmentlimit: {}".format(seg["seglimit"]))
-    # if seg["base_addr"] != 0:
-    #     deduced_pts += 1
-    #     penalties.append("Falsche Basisadresse: {}".format(seg["base_addr"]))
-    # if seg["type"] not in [10, 11, 14, 15]:
-    #     deduced_pts += 1
-    #     penalties.append("Falscher Segment Typ (type): {}".format(seg["type"]))
-    # if not seg["s"]:
-    #     deduced_pts += 1
-    #     penalties.append("Falscher Descriptor Typ (s): {}".format(seg["s"]))
-    # if seg["dpl"] > 1:
-    #     deduced_pts += 1
-    #     penalties.append("Falsches Privileg Level (dpl): " + str(seg["dpl"]))
-    # if not seg["p"]:
-    #     deduced_pts += 1
-    #     penalties.append("Segment muss praesent sein (p)")
-    # if seg["avl"]:
-    #     deduced_pts += 1
-    #     penalties.append("Segment steht nicht fuer das System zur Verfuegung")
-    # if seg["l"]:
-    #     deduced_pts += 1
-    #     penalties.append("Es handelt sich nicht um ein 64 Bit Segment (l)")
-    # if not seg["db"]:
-    #     deduced_pts += 1
-    #     penalties.append("Operation Size muss 32 Bit sein (db)")
-    # if not seg["g"]:
-    #     deduced_pts += 1
-    #     penalties.append("Granularität Bit muss gesetzt sein (g)")
-
-    # return deduced_pts, penalties
+    for pts, explanation in _code_seg_rubric.check(seg):
+        deduct_fn(pts, explanation)
 
 
-def _eval_data_seg(seg, deduct_fn):
-    deduced_pts = 0
-    penalties = []
+def _summarize(failed):
+    return sum(pts for pts, _ in failed), [pen for _, pen in failed]
 
-    if not (3071 <= seg["seglimit"] <= 3072):
-        deduced_pts += 1
-        penalties.append("Falsches Segmentlimit: {}".format(seg["seglimit"]))
-    if seg["base_addr"] != 0:
-        deduced_pts += 1
-        penalties.append("Falsche Basisadresse: {}".format(seg["base_addr"]))
-    if seg["type"] not in [2, 3]:
-        deduced_pts += 1
-        penalties.append("Falscher Segment Typ (type): {}".format(seg["type"]))
-    if not seg["s"]:
-        deduced_pts += 1
-        penalties.append("Falscher Descriptor Typ (s): {}".format(seg["s"]))
-    if seg["dpl"] > 1:
-        deduced_pts += 1
-        penalties.append("Falsches Privileg Level (dpl): " + str(seg["dpl"]))
-    if not seg["p"]:
-        deduced_pts += 1
-        penalties.append("Segment muss praesent sein (p)")
-    if seg["avl"]:
-        deduced_pts += 1
-        penalties.append("Segment steht nicht fuer das System zur Verfuegung")
-    if seg["l"]:
-        deduced_pts += 1
-        penalties.append("Es handelt sich nicht um ein 64 Bit Segment (l)")
-    if not seg["db"]:
-        deduced_pts += 1
-        penalties.append("Operation Size muss 32 Bit sein (db)")
-    if not seg["g"]:
-        deduced_pts += 1
-        penalties.append("Granularität Bit muss gesetzt sein (g)")
 
-    return deduced_pts, penalties
+def _eval_data_seg(seg, deduct_fn):
+    return _summarize(_data_seg_rubric.check(seg))
 
 
 def _eval_video_seg(seg, deduct_fn):
-    deduced_pts = 0
-    penalties = []
-
-    if not (0x7FFF <= seg["seglimit"] <= 0x8000):
-        deduced_pts += 1
-        penalties.append("Falsches Segmentlimit: {}".format(seg["seglimit"]))
-    if seg["base_addr"] != 0xB8000:
-        deduced_pts += 1
-        penalties.append("Falsche Basisadresse: {}".format(seg["base_addr"]))
-    if seg["type"] not in [2, 3]:
-        deduced_pts += 1
-        penalties.append("Falscher Segment Typ (type): {}".format(seg["type"]))
-    if not seg["s"]:
-        deduced_pts += 1
-        penalties.append("Falscher Descriptor Typ (s): {}".format(seg["s"]))
-    if seg["dpl"] > 1:
-        deduced_pts += 1
-        penalties.append("Falsches Privileg Level (dpl): " + str(seg["dpl"]))
-    if not seg["p"]:
-        deduced_pts += 1
-        penalties.append("Segment muss praesent sein (p)")
-    if seg["avl"]:
-        deduced_pts += 1
-        penalties.append("Segment steht nicht fuer das System zur Verfuegung")
-    if seg["l"]:
-        deduced_pts += 1
-        penalties.append("Es handelt sich nicht um ein 64 Bit Segment (l)")
-    if not seg["db"]:
-        deduced_pts += 1
-        penalties.append("Operation Size muss 32 Bit sein (db)")
-    if seg["g"]:
-        deduced_pts += 1
-        penalties.append("Granularität Bit darf nicht gesetzt sein (g)")
-
-    return deduced_pts, penalties
+    return _summarize(_video_seg_rubric.check(seg))
 
 
 def _eval_int_descriptor(ref_descr, descr, tag="int"):
@@ -208,79 +136,189 @@ def _eval_int_call(lines, int_no):
     return deduced_pts, penalties
 
 
+def _post_mortem(asm, history=8):
+    """
+    Run the code once more with a tracer, e.g. after it didn't terminate
+    :param asm: fresh AsmInterpreter of the code
+    :param history: number of instructions to describe
+    :return: penalty listing the last executed instructions
+    """
+    tracer = Tracer(history)
+    asm.tracer = tracer
+    asm.interpret()
+    return "Programm terminiert nicht, zuletzt ausgefuehrt: {}".format(
+        "; ".join(tracer.format_history()))
+
+
+# register checks of a task as (register, mask, expected value or label,
+# points, penalty)
+_task2_checks = (
+    ("cr0", 0x01, 0x01, 5, "PE Bit has to be enabled in CR0"),
+)
+
+_task3_checks = (
+    ("ds", 0xffff, "data", 2, "-2 Daten Segment falsch gesetzt"),
+    ("ss", 0xffff, "data", 2, "-2 Stack Segment falsch gesetzt"),
+    ("es", 0xffff, "video", 2, "-2 Extra Segment falsch gesetzt"),
+    ("esp", 0xffffffff, 0xBFFFFF, 4, "-4 Stack Pointer falsch gesetzt"),
+    ("fs", 0xffff, 0, 0, "FS falsch gesetzt"),
+    ("gs", 0xffff, 0, 0, "GS falsch gesetzt"),
+)
+
+
+def _eval_register_checks(checks, max_score, regs, labels):
+    """
+    Evaluate register checks for all rows of a RegisterBatch at once
+    :param checks: checks, see _task3_checks
+    :param max_score: score without penalties
+    :param regs: RegisterBatch
+    :param labels: list with the labels of every row
+    :return: list of (score, penalties) per row
+    """
+    results = [[max_score, []] for _ in range(len(regs))]
+    for reg, mask, expected, pts, penalty in checks:
+        if isinstance(expected, str):
+            expected = [l.get(expected) for l in labels]
+        else:
+            expected = [expected] * len(regs)
+        # a missing label never matches
+        known = [e is not None for e in expected]
+        expected = regs.vector([0 if e is None else e for e in expected])
+
+        ok = _vmap(lambda v, e: (v & mask) == e, regs.column(reg), expected)
+        for res, k, o in zip(results, known, ok):
+            if not (k and o):
+                res[0] -= pts
+                res[1].append(penalty)
+
+    return [tuple(res) for res in results]
+
+
+def _check_registers(checks, max_score, asm):
+    """
+    Evaluate register checks for a single interpreter, like
+    _eval_register_checks does for a batch
+    :param asm: AsmInterpreter after running the code
+    :return: (score, penalties)
+    """
+    score, penalties = max_score, []
+    for reg, mask, expected, pts, penalty in checks:
+        if isinstance(expected, str):
+            expected = asm.labels.get(expected)
+        # a missing label never matches
+        if expected is None or asm.regs[reg] & mask != expected & 0xffffffff:
+            score -= pts
+            penalties.append(penalty)
+
+    return score, penalties
+
+
+def _refers_to_labels(program):
+    return any(opnd.kind in (OPND_LABEL, OPND_EXPR)
+               for ins in program for opnd in ins.operands)
+
+
 class ExerciseHandler:
     _max_score = 60
-
-    def __init__(self, wd):
-        code = self._read_sourcecode(wd)
+    # increase whenever the grading changes, so cached grades get invalid
+    _rubric_version = 4
+    # graded tasks in the order they are graded
+    _tasks = (1, 2, 3, 4, 5, 7)
+    # tasks whose grading depends on the labels of the whole file
+    _label_tasks = (1, 3, 4, 5, 7)
+    # labels the checks of a task read, besides the ones its lines refer to
+    _checked_labels = {
+        3: tuple(e for _, _, e, _, _ in _task3_checks if isinstance(e, str)),
+        4: ("code", "interrupthandler1", "interrupthandler2"),
+    }
+    # tasks graded by the registers after running them, as task nr ->
+    # (max score, checks)
+    _register_tasks = {2: (5, _task2_checks), 3: (10, _task3_checks)}
+    # tasks continuing from the state the block of another task leaves, as
+    # task nr -> nr of the preceding task, like the bootstrap runs them
+    _prefix_tasks = {3: 2}
+
+    def __init__(self, wd=None, code=None):
+        if code is None:
+            code = self._read_sourcecode(wd)
+        # tokenize once, all consumers share the token stream
+        code = tokenize(code)
         self.tasks = self._extract_tasks(code)
         self.asm = AsmInterpreter(code)
         self.labels = {}
         self.score = self._max_score
         self.penalties = {}
+        # task nr -> result and deductions graded ahead by grade_batch
+        self._precomputed = {}
+        # task nr -> interpreter after running the block, see _prefix
+        self._prefixes = {}
 
     @staticmethod
     def get_exercise_name():
         return "Ue3"
 
+    @staticmethod
+    def get_default_archive():
+        return os.path.join("data", "BSY1UE3.zip")
+
     @classmethod
     def get_max_score(cls):
         return cls._max_score
 
+    @classmethod
+    def get_rubric_version(cls):
+        return "{}-{}".format(cls.get_exercise_name(), cls._rubric_version)
+
     @staticmethod
+    @timing.timed("normalize_files")
     def normalize_files(wd):
         files = os.listdir(wd)
 
         # add Makefile for easier processing
         if "makefile" not in [f.lower() for f in files]:
-            shutil.copyfile(makefile_src, os.path.join(wd, 'Makefile'))
+            _share_file(makefile_src, os.path.join(wd, 'Makefile'))
 
         if "write.c" not in files:
-            shutil.copyfile(write_src, os.path.join(wd, 'write.c'))
+            _share_file(write_src, os.path.join(wd, 'write.c'))
 
         # rename to protected.asm
-        os.chdir(wd)
         if "protected.asm" not in files:
             for f in [f for f in files if f.endswith(".asm")]:
-                os.replace(f, "protected.asm")
+                os.replace(os.path.join(wd, f),
+                           os.path.join(wd, "protected.asm"))
                 break
-        os.chdir("..")
 
     @staticmethod
+    def materialize_files(wd):
+        """
+        Replace the shared reference files of a submission folder with
+        private copies, which has to be done before anything (e.g. a build)
+        modifies the folder
+        :param wd: submission folder
+        """
+        for src, name in [(makefile_src, 'Makefile'), (write_src, 'write.c')]:
+            dst = os.path.join(wd, name)
+            if os.path.lexists(dst) and _is_shared(src, dst):
+                tmp = dst + ".tmp"
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, dst)
+
+    @staticmethod
+    @timing.timed("read_sourcecode")
     def _read_sourcecode(wd):
         with open(os.path.join(wd, "protected.asm"), encoding='latin-1') as f:
             lines = f.readlines()
         return lines
 
-    def _extract_tasks(self, lines):
-        return {
-            1: self._extract_task(lines, 1),
-            2: self._extract_task(lines, 2),
-            3: self._extract_task(lines, 3),
-            4: self._extract_task(lines, 4),
-            5: self._extract_task(lines, 5),
-            7: self._extract_task(lines, 7)
-        }
+    @classmethod
+    def _extract_tasks(cls, lines):
+        index = TaskIndex(tokenize(lines))
+        return {nr: index[nr] for nr in cls._tasks}
 
     @staticmethod
     def _extract_task(code, task_nr):
-        lines = []
-        read_lines = False
-        for l in code:
-            if "<AUFGABE{}>".format(task_nr) in l:
-                read_lines = True
-            elif "</AUFGABE{}>".format(task_nr) in l:
-                break
-            elif read_lines:
-                # another task started
-                if "<AUFGABE".format(task_nr) in l:
-                    break
-
-                l = l.strip()
-                if l and not l.startswith(";"):
-                    lines.append(l)
-
-        return lines
+        # SourceLines are stripped already
+        return list(TaskIndex(tokenize(code))[task_nr])
 
     def _deduct_points(self, task, score, pts, explanation):
         if task not in self.penalties:
@@ -297,8 +335,172 @@ class ExerciseHandler:
 
         return self.score, self.penalties
 
+    @classmethod
+    def grade_batch(cls, graders):
+        """
+        Grade many submissions at once. The segment checks and the register
+        tasks of all submissions, which aren't memoized yet, are evaluated
+        for the whole batch.
+        :param graders: ExerciseHandlers of the submissions
+        :return: list of (score, penalties) per submission
+        """
+        # only the first grader of a key grades the task, the others get
+        # its result from the memo
+        jobs = cls._pending_jobs(graders, 1)
+        if jobs:
+            deductions = cls._grade_segment_tasks(
+                [js[0] for js in jobs.values()])
+            for js, res in zip(jobs.values(), deductions):
+                if res is not None:
+                    js[0][0]._precomputed[1] = None, res
+
+        for nr in cls._register_tasks:
+            jobs = cls._pending_jobs(graders, nr)
+            if not jobs:
+                continue
+
+            results = cls._grade_register_tasks(
+                nr, [js[0] for js in jobs.values()])
+            for js, res in zip(jobs.values(), results):
+                js[0][0]._precomputed[nr] = res, ()
+
+        return [grader.grade_submission() for grader in graders]
+
+    @staticmethod
+    def _pending_jobs(graders, nr):
+        """
+        :return: dict of memo key -> list of (grader, lines) of the task
+        blocks, which aren't memoized yet, identical blocks share a key
+        """
+        jobs = collections.OrderedDict()
+        for grader in graders:
+            lines = grader.tasks.get(nr)
+            if lines is None:
+                continue
+            key = grader._memo_key(nr, lines)
+            if key not in task_memo:
+                jobs.setdefault(key, []).append((grader, lines))
+        return jobs
+
+    @classmethod
+    def _grade_segment_tasks(cls, jobs):
+        """
+        Evaluate the code segment checks of task 1 for all jobs at once
+        :param jobs: list of (grader, lines of task 1)
+        :return: list of deductions as (score, points, explanation) per job,
+        None for jobs which have to be graded on their own
+        """
+        max_score = 15
+        segments = []
+        for grader, lines in jobs:
+            segs = grader.asm.parse_segment_descriptors(lines)
+            # incomplete tables fail like in _grade_task1
+            segments.append(segs if all(name in segs for name in
+                                        ("code", "data", "video")) else None)
+
+        failed = iter(_code_seg_rubric.evaluate(
+            [segs["code"] for segs in segments if segs is not None]))
+        # penalties of the data and video segments aren't deducted either
+        deductions = []
+        for segs in segments:
+            if segs is None:
+                deductions.append(None)
+            else:
+                deductions.append(tuple((max_score, pts, explanation)
+                                        for pts, explanation in next(failed)))
+        return deductions
+
+    @classmethod
+    def _grade_register_tasks(cls, nr, jobs):
+        """
+        Run a register task of many submissions with run_batch
+        :param nr: task nr, see _register_tasks
+        :param jobs: list of (grader, lines of the task)
+        :return: list of (score, penalties) per job
+        """
+        max_score, checks = cls._register_tasks[nr]
+        programs, labels, starts = [], [], None
+        if nr in cls._prefix_tasks:
+            starts = [grader._prefix(cls._prefix_tasks[nr])
+                      for grader, _ in jobs]
+        for grader, lines in jobs:
+            program = decode(lines)
+            programs.append(program)
+            # only some tasks refer to the labels of the whole file
+            if nr in cls._label_tasks:
+                labels.append(grader.asm.labels)
+            elif _refers_to_labels(program):
+                labels.append(assemble(lines).labels)
+            else:
+                labels.append({})
+
+        regs = run_batch(programs, labels, starts)
+        return _eval_register_checks(checks, max_score, regs, labels)
+
+    def _block_interpreter(self, lines):
+        """
+        Interpreter of a task block, which refers to the labels and the data
+        of the whole file, e.g. lidt [idtr]
+        """
+        asm = AsmInterpreter(lines, self.asm.labels)
+        asm.image = self.asm.image
+        return asm
+
+    def _prefix(self, nr):
+        """
+        Interpreter after running the block of a task, which only runs once.
+        The tasks continuing from it fork it, see _prefix_tasks.
+        """
+        asm = self._prefixes.get(nr)
+        if asm is None:
+            asm = AsmInterpreter(self.tasks[nr], self.asm.labels
+                                 if nr in self._label_tasks else None)
+            asm.interpret()
+            self._prefixes[nr] = asm
+        return asm
+
+    def _memo_key(self, nr, lines):
+        # plain strings, so the memo doesn't keep the tokens alive
+        lines = tuple(str(l) for l in lines)
+        labels = ()
+        if nr in self._label_tasks:
+            # only the labels the lines refer to and the ones the checks
+            # read are resolved
+            labels = self.asm.labels
+            checked = self._checked_labels.get(nr, ())
+            labels = tuple(sorted((k, labels[k]) for k in labels
+                                  if k in checked or
+                                  any(k in l for l in lines)))
+        state = ()
+        if nr in self._prefix_tasks:
+            # the result depends on the state the task starts from
+            prefix = self._prefix(self._prefix_tasks[nr])
+            state = tuple(prefix.regs._slots), tuple(prefix.stack)
+        return type(self), nr, lines, labels, state
+
     def _grade_task(self, nr, lines):
+        key = self._memo_key(nr, lines)
+        entry = task_memo.get(key)
+        if entry is None:
+            prev = len(self.penalties.get(nr, []))
+            res = self._grade_task_uncached(nr, lines)
+            entry = res, tuple(self.penalties.get(nr, [])[prev:])
+            task_memo.put(key, entry)
+        else:
+            res, deductions = entry
+            if deductions:
+                self.penalties.setdefault(nr, []).extend(deductions)
+
+        return res
+
+    def _grade_task_uncached(self, nr, lines):
         deduct_fn = functools.partial(self._deduct_points, nr)
+        if nr in self._precomputed:
+            res, deductions = self._precomputed.pop(nr)
+            for args in deductions:
+                deduct_fn(*args)
+            return res
+
         if nr == 1:
             return self._grade_task1(deduct_fn, lines)
         elif nr == 2:
@@ -314,6 +516,7 @@ class ExerciseHandler:
         else:
             return 0, ["Invalid task"]
 
+    @timing.timed("grade_task1")
     def _grade_task1(self, deduct_fn, lines):
         max_score = 15
         deduct_fn = functools.partial(deduct_fn, max_score)
@@ -342,59 +545,37 @@ class ExerciseHandler:
 
         # return max_score, penalties
 
+    @timing.timed("grade_task2")
     def _grade_task2(self, deduct_fn, lines):
-        max_score = 5
-        asm = AsmInterpreter(lines)
-        res = asm.interpret()
-
-        if res["cr0"] & 0x01 == 0:
-            return 0, ["PE Bit has to be enabled in CR0"]
-        else:
-            return max_score, []
+        return self._grade_register_task(2, lines)
 
+    @timing.timed("grade_task3")
     def _grade_task3(self, deduct_fn, lines):
-        max_score = 10
-
-        labels = {
-            "code": 150,
-            "data": 160,
-            "video": 170
-        }
-
-        asm = AsmInterpreter(lines, labels)
-        res = asm.interpret()
-
-        penalties = []
-        if not (asm.regs["ds"] == labels["data"]):
-            max_score -= 2
-            penalties.append("-2 Daten Segment falsch gesetzt")
-        if not (asm.regs["ss"] == labels["data"]):
-            max_score -= 2
-            penalties.append("-2 Stack Segment falsch gesetzt")
-        if not (asm.regs["es"] == labels["video"]):
-            max_score -= 2
-            penalties.append("-2 Extra Segment falsch gesetzt")
-        if not (asm.regs["esp"] == 0xBFFFFF):
-            max_score -= 4
-            penalties.append("-4 Stack Pointer falsch gesetzt")
-        if not (asm.regs["fs"] == 0):
-            penalties.append("FS falsch gesetzt")
-        if not (asm.regs["gs"] == 0):
-            penalties.append("GS falsch gesetzt")
-
-        return max_score, penalties
+        # segment selectors are compared with the labels of the submission
+        return self._grade_register_task(3, lines)
+
+    def _grade_register_task(self, nr, lines):
+        # a single submission runs on the scalar interpreter, see
+        # _grade_register_tasks for batches
+        max_score, checks = self._register_tasks[nr]
+        labels = self.asm.labels if nr in self._label_tasks else None
+        if nr in self._prefix_tasks:
+            asm = self._prefix(self._prefix_tasks[nr]).fork(labels)
+            asm.interpret(lines)
+        elif lines == self.tasks.get(nr):
+            # the block may be the prefix of other tasks
+            asm = self._prefix(nr)
+        else:
+            asm = AsmInterpreter(lines, labels)
+            asm.interpret()
+        return _check_registers(checks, max_score, asm)
 
+    @timing.timed("grade_task4")
     def _grade_task4(self, deduct_fn, lines):
         max_score = 20
 
-        labels = {
-            "code": 150,
-            "data": 160,
-            "video": 170,
-            "interrupthandler1": 180,
-            "interrupthandler2": 190
-        }
-        # asm = AsmInterpreter(lines, labels)
+        # addresses of the handlers and segment selectors of the submission
+        labels = self.asm.labels
         descrs = self.asm.parse_descriptors(lines, is_seg_descriptor=False)
 
         penalties = []
@@ -404,8 +585,8 @@ class ExerciseHandler:
 
         # check first interrupt
         int_descr = {
-            "offset": labels["interrupthandler1"],
-            "segment": labels["code"],
+            "offset": labels.get("interrupthandler1", -1),
+            "segment": labels.get("code", -1),
             "dummy": 0,
             "type": "interrupt_gate",
             "d": 1,
@@ -418,7 +599,8 @@ class ExerciseHandler:
         penalties += pens
 
         # check interrupt for task 7
-        int_descr["offset"] = (labels["interrupthandler2"] + (0x80 << 16))
+        int_descr["offset"] = (labels.get("interrupthandler2", -1) +
+                               (0x80 << 16))
         pts, pens = _eval_int_descriptor(int_descr, descrs[2], "int2")
         max_score -= pts
         penalties += pens
@@ -430,17 +612,19 @@ class ExerciseHandler:
 
         return max_score, penalties
 
+    @timing.timed("grade_task5")
     def _grade_task5(self, deduct_fn, lines):
         max_score = 5
         penalties = []
 
-        found_ldtr = False
-        for l in lines:
-            if "lidt [idtr]" in l:
-                found_ldtr = True
-                break
+        asm = self._block_interpreter(lines)
+        asm.interpret()
+        if asm.exhausted:
+            # reported without deducting points
+            deduct_fn(max_score, 0,
+                      _post_mortem(self._block_interpreter(lines)))
 
-        if not found_ldtr:
+        if ("lidt", "idtr") not in asm.loaded_tables:
             max_score -= 3
             penalties.append("Interrupt Descriptor Table muss geladen werden")
 
@@ -450,17 +634,19 @@ class ExerciseHandler:
 
         return max_score, penalties
 
+    @timing.timed("grade_task7")
     def _grade_task7(self, deduct_fn, lines):
         max_score = 5
         penalties = []
 
-        found_call = False
-        for l in lines:
-            if "call startpaging" in l:
-                found_call = True
-                break
+        asm = self._block_interpreter(lines)
+        asm.interpret()
+        if asm.exhausted:
+            # reported without deducting points
+            deduct_fn(max_score, 0,
+                      _post_mortem(self._block_interpreter(lines)))
 
-        if not found_call:
+        if "startpaging" not in asm.calls:
             max_score -= 3
             penalties.append("Paging muss aktiviert werden")
 
@@ -0,0 +1,82 @@
+"""
+Registry of the exercise graders. Exercise modules are only imported when
+their exercise is requested, so startup doesn't depend on the number of
+registered exercises.
+
+Further exercises can be registered with register() or as entry points of
+the group "tutgrader.exercises", e.g. in a setup.py:
+
+    entry_points={"tutgrader.exercises": ["ue4 = exc4_paging:ExerciseHandler"]}
+"""
+import logging
+import importlib
+from importlib import metadata
+
+entry_point_group = "tutgrader.exercises"
+default_exercise = "ue3"
+
+# exercise name -> "module:class" or handler class
+_registry = {
+    "ue3": "exc3_protected:ExerciseHandler",
+}
+_entry_points = None
+_loaded = {}
+
+
+def register(name, target):
+    """
+    Register an exercise
+    :param name: name of the exercise, as used on the command line
+    :param target: "module:class" of the handler, which is imported on first
+    use, or the handler class itself
+    """
+    _registry[name] = target
+    _loaded.pop(name, None)
+
+
+def _get_entry_points():
+    # only the package metadata is read, no exercise module gets imported
+    global _entry_points
+    if _entry_points is None:
+        try:
+            eps = metadata.entry_points(group=entry_point_group)
+        except TypeError:  # python < 3.10
+            eps = metadata.entry_points().get(entry_point_group, [])
+        _entry_points = {ep.name: ep for ep in eps}
+    return _entry_points
+
+
+def names():
+    return sorted(set(_registry) | set(_get_entry_points()))
+
+
+def _load(target):
+    if not isinstance(target, str):
+        return target
+
+    module, _, attr = target.partition(':')
+    return getattr(importlib.import_module(module), attr or "ExerciseHandler")
+
+
+def get(name=None):
+    """
+    Get the handler class of an exercise, importing its module if necessary
+    :param name: name of the exercise, None for the default exercise
+    :return: ExerciseHandler class of the exercise
+    """
+    if name is None:
+        name = default_exercise
+
+    handler = _loaded.get(name)
+    if handler is None:
+        if name in _registry:
+            handler = _load(_registry[name])
+        elif name in _get_entry_points():
+            handler = _get_entry_points()[name].load()
+        else:
+            raise ValueError("Unknown exercise '{}', available: {}"
+                             .format(name, ', '.join(names())))
+        logging.debug("loaded exercise {}".format(name))
+        _loaded[name] = handler
+
+    return handler
@@ -0,0 +1,63 @@
+import os
+import pickle
+import hashlib
+import logging
+
+cache_file = "grades.cache"
+
+
+class GradeCache:
+    """
+    Persistent cache of grading results, keyed by a hash of the submitted
+    source code and the version of the rubric it was graded with
+    """
+    def __init__(self, path, rubric_version):
+        self.path = path
+        self.rubric_version = str(rubric_version)
+        self._entries = self._load(path)
+        self._added = 0
+
+    @staticmethod
+    def _load(path):
+        if not os.path.exists(path):
+            return {}
+
+        try:
+            with open(path, mode='rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning("couldn't load grade cache {}, because: {}"
+                            .format(path, e))
+            return {}
+
+    def key(self, code):
+        h = hashlib.sha256(self.rubric_version.encode('utf-8'))
+        for l in code:
+            h.update(l.encode('latin-1', errors='replace'))
+        return h.hexdigest()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, grade):
+        if key not in self._entries:
+            self._added += 1
+        self._entries[key] = grade
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self):
+        if not self._added:
+            return
+
+        # write to a temporary file first so an aborted run can't
+        # corrupt the cache
+        tmp = self.path + ".tmp"
+        with open(tmp, mode='wb') as f:
+            pickle.dump(self._entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self._added = 0
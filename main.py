@@ -1,11 +1,33 @@
+import io
 import os
 import logging
 import shutil
-from zipfile import is_zipfile, ZipFile
+import argparse
+import time
+import json
+import functools
+import itertools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from zipfile import is_zipfile, BadZipFile, ZipFile
 
-from exc3_protected import ExerciseHandler
+import exercises
+from task_memo import task_memo
+from grade_cache import GradeCache, cache_file
+import timing
+import reports
+import async_pipeline
+from spool import SpoolWatcher
+from similarity import SimilarityIndex
 output_dir = "out"
-report_name_template = "{}_grades.txt"
+report_name_template = "{}_grades.{}"
+live_report_name_template = "{}_grades_unsorted.{}"
+timings_name = "timings.json"
+similarity_name_template = "{}_similarity.json"
+
+# cache of previous grading results and graded exercise, set per process
+_cache = None
+_exercise = None
 
 
 def extract_name(folder_name):
@@ -14,10 +36,11 @@ def extract_name(folder_name):
 
 
 def rename_submission_folders(wd):
-    for d in os.listdir('.'):
-        os.replace(d, extract_name(d))
+    for d in os.listdir(wd):
+        os.replace(os.path.join(wd, d), os.path.join(wd, extract_name(d)))
 
 
+@timing.timed("extract_submission")
 def extract_submission(wd):
     files = os.listdir(wd)
     if len(files) > 1:
@@ -47,9 +70,189 @@ def extract_submission(wd):
         os.rmdir(src_dir)
 
 
-def handle_submissions(subs_src):
-    prev_dir = os.getcwd()
-    wd = output_dir
+def _select_source(names):
+    """
+    Pick the assembler source out of the member names of a submission the
+    same way extract_submission and normalize_files would pick it on disk
+    :param names: member names of the submission archive
+    :return: member name of the source file or None if there is none
+    """
+    files = [n for n in names if not n.endswith('/')]
+
+    # probably intermediary folder
+    prefix = ''
+    top = {n.split('/', 1)[0] for n in files}
+    if len(top) == 1 and all('/' in n for n in files):
+        prefix = top.pop() + '/'
+
+    files = [n for n in files
+             if n.startswith(prefix) and '/' not in n[len(prefix):]]
+    if prefix + "protected.asm" in files:
+        return prefix + "protected.asm"
+    return next(iter([n for n in files if n.endswith(".asm")]), None)
+
+
+def _read_member(archive, member):
+    with archive.open(member) as f:
+        return io.TextIOWrapper(f, encoding='latin-1').readlines()
+
+
+def iter_archive_sources(subs_src):
+    """
+    Read the source code of every submission straight from the archive
+    without extracting anything to disk
+    :param subs_src: zip archive containing all submissions
+    :return: iterator of 2-tuples of the student name and the source lines
+    """
+    with ZipFile(subs_src) as subs:
+        folders = {}
+        for member in subs.namelist():
+            folder, _, name = member.partition('/')
+            if name:
+                folders.setdefault(folder, []).append(name)
+
+        for folder, files in folders.items():
+            student = extract_name(folder)
+            if len(files) > 1:
+                logging.warning("{} contains more than 1 submission: {}"
+                                .format(student, ', '.join(files)))
+
+            path = '/'.join([folder, files[0]])
+            try:
+                # open nested submission from an in-memory buffer
+                with ZipFile(io.BytesIO(subs.read(path))) as sub:
+                    member = _select_source(sub.namelist())
+                    code = _read_member(sub, member) if member else None
+            except BadZipFile:
+                member = _select_source(files)
+                code = (_read_member(subs, '/'.join([folder, member]))
+                        if member else None)
+
+            if code is None:
+                logging.error("no source found in submission of {}"
+                              .format(student))
+                continue
+
+            yield student, code
+
+
+def _init_worker(cache, timings=False, exercise=None):
+    global _cache, _exercise
+    _cache = cache
+    _exercise = exercise
+    timing.enable(timings)
+
+
+def _handler():
+    return exercises.get(_exercise)
+
+
+def _is_skipped(name):
+    if "Lehrbaum" in name:
+        logging.warning("~~~~~ skipping {}".format(name))
+        return True
+    return False
+
+
+def _cached_grade(name, code):
+    """
+    :return: cache key of the code and its cached grade or None
+    """
+    key = _cache.key(code) if _cache is not None else None
+    grade = _cache.get(key) if key is not None else None
+    if grade is not None:
+        logging.info("~~~~~ {} unchanged, using cached grade".format(name))
+    return key, grade
+
+
+def _grade_code(name, code):
+    logging.info("-- Grading {} ".format(name))
+    if _is_skipped(name):
+        return name, None, None
+
+    key, grade = _cached_grade(name, code)
+    if grade is None:
+        grader = _handler()(code=code)
+        grade = grader.grade_submission()
+
+    return name, grade, key
+
+
+def grade_source(name, code):
+    """
+    Grade the given source code of a single submission
+    :param name: name of the student
+    :param code: lines of the submitted source code
+    :return: 3-tuple of the student name, its grade, which is None if the
+    submission was skipped, and its cache key
+    """
+    with timing.submission(name):
+        return _grade_code(name, code)
+
+
+def grade_sources(jobs):
+    """
+    Grade the source code of several submissions at once. Exercises with a
+    grade_batch grade all submissions of the batch together.
+    :param jobs: list of (name, code) tuples
+    :return: list of results, see grade_source
+    """
+    handler = _handler()
+    if not hasattr(handler, "grade_batch"):
+        return [grade_source(name, code) for name, code in jobs]
+
+    results = []
+    pending = []
+    for name, code in jobs:
+        logging.info("-- Grading {} ".format(name))
+        if _is_skipped(name):
+            results.append((name, None, None))
+            continue
+
+        key, grade = _cached_grade(name, code)
+        if grade is None:
+            with timing.submission(name):
+                pending.append((len(results), handler(code=code)))
+        results.append((name, grade, key))
+
+    if pending:
+        with timing.stage("grade_batch"):
+            grades = handler.grade_batch([g for _, g in pending])
+        for (nr, _), grade in zip(pending, grades):
+            name, _, key = results[nr]
+            results[nr] = name, grade, key
+
+    return results
+
+
+def _chunks(jobs, size):
+    it = iter(jobs)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield (chunk,)
+
+
+def grade_submission_dir(path):
+    """
+    Extract, normalize and grade a single submission folder
+    :param path: absolute path of the submission folder
+    :return: see grade_source
+    """
+    name = os.path.basename(path)
+    with timing.submission(name):
+        extract_submission(path)
+
+        _handler().normalize_files(path)
+        if _is_skipped(name):
+            return name, None, None
+
+        return _grade_code(name, _handler()._read_sourcecode(path))
+
+
+def unpack_submissions(subs_src):
+    wd = os.path.abspath(output_dir)
     if os.path.exists(wd):
         shutil.rmtree(wd)
     os.makedirs(wd)
@@ -58,57 +261,340 @@ def handle_submissions(subs_src):
     with ZipFile(subs_src) as subs:
         subs.extractall(wd)
 
-    # work in the output directory
-    os.chdir(os.path.join(os.getcwd(), wd))
-
     rename_submission_folders(wd)
 
-    # unpack zip of each submission
-    # and grade submission
-    grades = {}
+    return [os.path.join(wd, d) for d in os.listdir(wd)]
 
-    for d in os.listdir():
-        extract_submission(d)
 
-        ExerciseHandler.normalize_files(d)
-        logging.info("-- Grading {} ".format(d))
-        if "Lehrbaum" in d:
-            a = 5
-            logging.warning("~~~~~ skipping {}".format(d))
-            continue
-        grader = ExerciseHandler(d)
-        grades[d] = grader.grade_submission()
+def _worker_job(grade_fn, *args):
+    # pass the stats recorded in the worker back to the parent
+    return grade_fn(*args), timing.collect(), task_memo.collect_stats()
+
+
+def _merge_stats(res, samples, memo_stats):
+    timing.merge(samples)
+    task_memo.merge_stats(memo_stats)
+    return res
+
+
+def _iter_results(grade_fn, jobs, workers):
+    timings = timing.is_enabled()
+    if workers <= 1:
+        for job in jobs:
+            yield grade_fn(*job)
+        return
+
+    # workers only get the name of the exercise and import it on first use
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(_cache, timings, _exercise)) as pool:
+        # keep a few jobs per worker queued and yield results as they finish
+        pending = set()
+        for job in jobs:
+            pending.add(pool.submit(_worker_job, grade_fn, *job))
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    yield _merge_stats(*f.result())
+
+        for f in pending:
+            yield _merge_stats(*f.result())
+
+
+def _cache_result(cache, key, grade):
+    """
+    Store a fresh grade in the cache
+    :return: True if the grade was taken from the cache
+    """
+    if key is None:
+        return False
+    if key in cache:
+        return True
+    cache.put(key, grade)
+    return False
+
+
+def _finish_run(cache, hits, count):
+    _init_worker(None, timing.is_enabled())
+    for task_nr, stats in sorted(task_memo.stats().items()):
+        logging.info("Aufgabe {}: {} of {} task gradings memoized"
+                     .format(task_nr, stats["hits"],
+                             stats["hits"] + stats["misses"]))
+    if cache is not None:
+        logging.info("{} of {} grades taken from the cache"
+                     .format(hits, count))
+        cache.save()
+
+
+def _iter_grades(grade_fn, jobs, workers, cache, exercise):
+    _init_worker(cache, timing.is_enabled(), exercise)
+    task_memo.collect_stats()
+    count = 0
+    hits = 0
+    try:
+        for res in _iter_results(grade_fn, jobs, workers):
+            # batches return a list of results
+            for name, grade, key in (res if isinstance(res, list) else [res]):
+                if grade is None:
+                    continue
+
+                count += 1
+                hits += _cache_result(cache, key, grade)
+                yield (name,) + tuple(grade)
+    finally:
+        _finish_run(cache, hits, count)
+
+
+def iter_grades(subs_src, workers=1, in_memory=False, cache=None,
+                exercise=None, batch_size=None):
+    """
+    Grade all submissions of the archive
+    :param subs_src: zip archive containing all submissions
+    :param workers: number of processes used for grading
+    :param in_memory: grade straight from the archive without extracting the
+    submissions to disk
+    :param cache: GradeCache of previous results or None
+    :param exercise: name of the exercise in the registry, None for the
+    default exercise
+    :param batch_size: grade this many submissions at once, implies
+    in_memory
+    :return: iterator of (student, score, penalties) tuples in the order the
+    submissions finish
+    """
+    if batch_size:
+        jobs = _chunks(iter_archive_sources(subs_src), batch_size)
+        grade_fn = grade_sources
+    elif in_memory:
+        jobs = iter_archive_sources(subs_src)
+        grade_fn = grade_source
+    else:
+        # unpack zip of each submission
+        # and grade submission
+        jobs = [(d,) for d in unpack_submissions(subs_src)]
+        grade_fn = grade_submission_dir
+
+    return _iter_grades(grade_fn, jobs, workers, cache, exercise)
+
+
+def grade_pipelined(subs_src, write_fn, workers=1, cache=None,
+                    exercise=None):
+    """
+    Grade all submissions of the archive in an asyncio pipeline, which reads
+    and decompresses the next submissions and writes finished grades while
+    the workers grade
+    :param subs_src: zip archive containing all submissions
+    :param write_fn: function called with student, score and penalties of
+    every graded submission
+    :param workers: number of processes used for grading
+    :param cache: GradeCache of previous results or None
+    :param exercise: name of the exercise in the registry
+    :return: number of graded submissions
+    """
+    timings = timing.is_enabled()
+    _init_worker(cache, timings, exercise)
+    task_memo.collect_stats()
+    counts = {"count": 0, "hits": 0}
+
+    def write(res):
+        name, grade, key = _merge_stats(*res)
+        if grade is None:
+            return
+        counts["count"] += 1
+        counts["hits"] += _cache_result(cache, key, grade)
+        write_fn(name, *grade)
+
+    try:
+        async_pipeline.run(iter_archive_sources(subs_src),
+                           functools.partial(_worker_job, grade_source),
+                           write, workers, initializer=_init_worker,
+                           initargs=(cache, timings, exercise))
+    finally:
+        _finish_run(cache, counts["hits"], counts["count"])
 
-    # restore previous working directory
-    os.chdir(prev_dir)
+    return counts["count"]
+
+
+def _grade_arrival(path):
+    # a single broken upload must not stop watching the spool
+    try:
+        return grade_submission_dir(path)
+    except Exception:
+        logging.exception("couldn't grade {}".format(path))
+        return os.path.basename(path), None, None
+
+
+def _iter_arrivals(spool_dir, poll_interval, polls):
+    wd = os.path.abspath(output_dir)
+    os.makedirs(wd, exist_ok=True)
+
+    watcher = SpoolWatcher(spool_dir)
+    while polls is None or polls > 0:
+        for path in watcher.poll():
+            folder = os.path.splitext(os.path.basename(path))[0]
+            name = extract_name(folder) or folder
+
+            # a new upload replaces the previous submission of the student
+            sub_dir = os.path.join(wd, name)
+            if os.path.exists(sub_dir):
+                shutil.rmtree(sub_dir)
+            os.makedirs(sub_dir)
+            shutil.copy(path, sub_dir)
+
+            yield (sub_dir,)
+
+        if polls is not None:
+            polls -= 1
+        time.sleep(poll_interval)
+
+
+def watch_submissions(spool_dir, poll_interval=1.0, cache=None, polls=None,
+                      exercise=None):
+    """
+    Grade every submission zip dropped into the spool directory as soon as
+    its upload is complete
+    :param spool_dir: directory which receives the submission zips
+    :param poll_interval: seconds between two checks of the spool directory
+    :param cache: GradeCache of previous results or None
+    :param polls: number of checks before returning, None to run forever
+    :param exercise: name of the exercise in the registry
+    :return: iterator of (student, score, penalties) tuples
+    """
+    jobs = _iter_arrivals(spool_dir, poll_interval, polls)
+    return _iter_grades(_grade_arrival, jobs, 1, cache, exercise)
+
+
+def handle_submissions(subs_src, workers=1, in_memory=False, cache=None,
+                       exercise=None, batch_size=None):
+    grades = {}
+    for student, score, penalties in iter_grades(subs_src, workers,
+                                                 in_memory, cache, exercise,
+                                                 batch_size):
+        grades[student] = score, penalties
 
     return grades
 
 
-def print_report(grades, dst_file):
-    with open(dst_file, mode='w', encoding='utf-8') as rep:
+def find_similar_submissions(subs_src, threshold=0.8, exercise=None):
+    """
+    Find clusters of submissions with nearly identical task blocks
+    :param subs_src: zip archive containing all submissions
+    :param threshold: min. estimated similarity of two task blocks
+    :param exercise: name of the exercise in the registry
+    :return: dict of task nr -> list of clusters of student names
+    """
+    handler = exercises.get(exercise)
+    index = SimilarityIndex(threshold=threshold)
+    for student, code in iter_archive_sources(subs_src):
+        index.add(student, handler._extract_tasks(code))
+
+    return index.clusters()
+
+
+def print_report(grades, dst_file, exercise=None):
+    max_score = exercises.get(exercise).get_max_score()
+    with reports.TextReport(dst_file, max_score) as rep:
         for student in sorted(grades.keys()):
-            grade = grades[student]
-            rep.write("{} [{}/{}]:\n".format(
-                student, grade[0], ExerciseHandler.get_max_score()))
+            rep.write(student, *grades[student])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Grade submissions")
+    parser.add_argument("submissions", nargs="?", default=None,
+                        help="zip archive containing all submissions "
+                             "(default: archive of the exercise)")
+    parser.add_argument("--exercise", default=exercises.default_exercise,
+                        choices=exercises.names(),
+                        help="exercise to grade")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used for grading")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="grade straight from the archive without "
+                             "extracting the submissions to disk")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="overlap reading, grading and writing in an "
+                             "asyncio pipeline (implies --in-memory)")
+    parser.add_argument("--batch", type=int, default=None, metavar="N",
+                        help="grade N submissions at once, running their "
+                             "register tasks in lockstep (implies "
+                             "--in-memory)")
+    parser.add_argument("--cache", nargs="?", const=cache_file, default=None,
+                        help="only grade submissions whose source changed "
+                             "since the last run (default file: {})"
+                        .format(cache_file))
+    parser.add_argument("--timings", action="store_true",
+                        help="record the time spent per stage and write a "
+                             "summary to {}".format(timings_name))
+    parser.add_argument("--watch", metavar="SPOOL_DIR",
+                        help="keep running and grade every submission zip "
+                             "dropped into SPOOL_DIR")
+    parser.add_argument("--poll-interval", type=float, default=1.0,
+                        help="seconds between two checks of SPOOL_DIR")
+    parser.add_argument("--similarity", type=float, nargs="?", const=0.8,
+                        metavar="THRESHOLD",
+                        help="also report clusters of nearly identical task "
+                             "blocks (default threshold: 0.8)")
+    parser.add_argument("--report", nargs="+", default=["txt"],
+                        choices=sorted(reports.report_types.keys()),
+                        help="report formats to write")
+    return parser.parse_args(argv)
 
-            for task_nr, pens in grade[1].items():
-                if len(pens) == 0:
-                    continue
 
-                rep.write('\tAufgabe {}:\n'.format(task_nr))
-                for p in pens:
-                    rep.write('\t\t{}\n'.format(p))
-                rep.write('\n')
+def main(argv=None):
+    args = parse_args(argv)
+    timing.enable(args.timings)
+    handler = exercises.get(args.exercise)
+    subs_src = args.submissions or handler.get_default_archive()
+    cache = (GradeCache(args.cache, handler.get_rubric_version())
+             if args.cache else None)
+    if args.watch:
+        grades = watch_submissions(args.watch, args.poll_interval, cache,
+                                   exercise=args.exercise)
+    elif args.pipelined:
+        grades = None
+    else:
+        grades = iter_grades(subs_src, workers=args.workers,
+                             in_memory=args.in_memory, cache=cache,
+                             exercise=args.exercise, batch_size=args.batch)
 
-            rep.write('\n')
+    os.makedirs(output_dir, exist_ok=True)
+    name = handler.get_exercise_name()
+    max_score = handler.get_max_score()
+    with contextlib.ExitStack() as stack:
+        live, final = [], []
+        for ext in args.report:
+            report_type = reports.report_types[ext]
+            live.append(stack.enter_context(report_type(os.path.join(
+                output_dir, live_report_name_template.format(name, ext)),
+                max_score, append=bool(args.watch))))
+            if not args.watch:
+                final.append(stack.enter_context(report_type(os.path.join(
+                    output_dir, report_name_template.format(name, ext)),
+                    max_score)))
+
+        try:
+            if grades is None:
+                writer = reports.ReportWriter(live, final)
+                grade_pipelined(subs_src, writer.write, args.workers, cache,
+                                args.exercise)
+                writer.finish()
+            else:
+                reports.write_reports(grades, live, final)
+        except KeyboardInterrupt:
+            if not args.watch:
+                raise
+            grades.close()
 
+    if args.similarity and not args.watch:
+        clusters = find_similar_submissions(subs_src, args.similarity,
+                                            args.exercise)
+        with open(os.path.join(output_dir,
+                               similarity_name_template.format(name)),
+                  mode='w', encoding='utf-8') as f:
+            json.dump({"Aufgabe {}".format(k): v
+                       for k, v in sorted(clusters.items())},
+                      f, indent=2, ensure_ascii=False)
 
-def main():
-    submissions = "data/BSY1UE3.zip"
-    grades = handle_submissions(submissions)
-    rep_name = report_name_template.format(ExerciseHandler.get_exercise_name())
-    print_report(grades, os.path.join(output_dir, rep_name))
+    if args.timings:
+        timing.write_summary(os.path.join(output_dir, timings_name))
 
 
 if __name__ == "__main__":
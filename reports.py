@@ -0,0 +1,183 @@
+import csv
+import json
+import heapq
+import pickle
+import tempfile
+
+
+class Report:
+    """
+    Report which is written incrementally, one graded submission at a time
+    """
+    extension = None
+
+    def __init__(self, dst_file, max_score, append=False):
+        self.max_score = max_score
+        self._f = open(dst_file, mode='a' if append else 'w',
+                       encoding='utf-8', newline='')
+
+    def write(self, student, score, penalties):
+        self._write(student, score, penalties)
+        # make progress visible while grading is still running
+        self._f.flush()
+
+    def _write(self, student, score, penalties):
+        raise NotImplementedError()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class TextReport(Report):
+    extension = "txt"
+
+    def _write(self, student, score, penalties):
+        rep = self._f
+        rep.write("{} [{}/{}]:\n".format(student, score, self.max_score))
+
+        for task_nr, pens in penalties.items():
+            if len(pens) == 0:
+                continue
+
+            rep.write('\tAufgabe {}:\n'.format(task_nr))
+            for p in pens:
+                rep.write('\t\t{}\n'.format(p))
+            rep.write('\n')
+
+        rep.write('\n')
+
+
+class CsvReport(Report):
+    extension = "csv"
+
+    def __init__(self, dst_file, max_score, append=False):
+        super().__init__(dst_file, max_score, append)
+        self._csv = csv.writer(self._f)
+        if self._f.tell() == 0:
+            self._csv.writerow(["student", "score", "max_score",
+                                "penalties"])
+
+    def _write(self, student, score, penalties):
+        pens = ["Aufgabe {}: {}".format(task_nr, p)
+                for task_nr, task_pens in penalties.items()
+                for p in task_pens]
+        self._csv.writerow([student, score, self.max_score, " | ".join(pens)])
+
+
+class JsonLinesReport(Report):
+    extension = "jsonl"
+
+    def _write(self, student, score, penalties):
+        self._f.write(json.dumps({
+            "student": student,
+            "score": score,
+            "max_score": self.max_score,
+            "penalties": {str(k): v for k, v in penalties.items()}
+        }, ensure_ascii=False))
+        self._f.write('\n')
+
+
+report_types = {r.extension: r for r in [TextReport, CsvReport,
+                                         JsonLinesReport]}
+
+
+class ExternalSort:
+    """
+    Sort more items than should be kept in memory: full chunks are sorted
+    and spilled to temporary files, which are merged lazily on iteration
+    """
+    def __init__(self, key=None, chunk_size=10000):
+        self.key = key
+        self.chunk_size = chunk_size
+        self._chunk = []
+        self._runs = []
+
+    def add(self, item):
+        self._chunk.append(item)
+        if len(self._chunk) >= self.chunk_size:
+            self._spill()
+
+    def _spill(self):
+        self._chunk.sort(key=self.key)
+        run = tempfile.TemporaryFile()
+        for item in self._chunk:
+            pickle.dump(item, run, protocol=pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self._runs.append(run)
+        self._chunk = []
+
+    @staticmethod
+    def _read_run(run):
+        try:
+            while True:
+                yield pickle.load(run)
+        except EOFError:
+            pass
+        finally:
+            run.close()
+
+    def __iter__(self):
+        self._chunk.sort(key=self.key)
+        runs = [self._read_run(r) for r in self._runs]
+        chunk, self._chunk, self._runs = self._chunk, [], []
+        return heapq.merge(*runs, chunk, key=self.key)
+
+
+class ReportWriter:
+    """
+    Write grades to live reports as they arrive and to sorted reports once
+    all grades arrived
+    """
+    def __init__(self, live_reports=(), sorted_reports=(), chunk_size=10000):
+        """
+        :param live_reports: reports written in the order the grades arrive
+        :param sorted_reports: reports written sorted by student name
+        :param chunk_size: max. number of grades kept in memory for sorting
+        """
+        self.live_reports = live_reports
+        self.sorted_reports = sorted_reports
+        self.count = 0
+        self._spool = ExternalSort(key=lambda g: g[0], chunk_size=chunk_size)
+
+    def write(self, student, score, penalties):
+        for rep in self.live_reports:
+            rep.write(student, score, penalties)
+        if self.sorted_reports:
+            self._spool.add((student, score, penalties))
+        self.count += 1
+
+    def finish(self):
+        """
+        Write the sorted reports
+        :return: number of written grades
+        """
+        if self.sorted_reports:
+            for grade in self._spool:
+                for rep in self.sorted_reports:
+                    rep.write(*grade)
+        return self.count
+
+
+def write_reports(grades, live_reports=(), sorted_reports=(),
+                  chunk_size=10000):
+    """
+    Write the grades to all reports while they are produced
+    :param grades: iterable of (student, score, penalties) tuples
+    :param live_reports: reports written in the order the grades arrive
+    :param sorted_reports: reports written sorted by student name once all
+    grades arrived
+    :param chunk_size: max. number of grades kept in memory for sorting
+    :return: number of written grades
+    """
+    writer = ReportWriter(live_reports, sorted_reports, chunk_size)
+    for grade in grades:
+        writer.write(*grade)
+
+    return writer.finish()
@@ -0,0 +1,75 @@
+import functools
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def between(lo, hi):
+    return lambda x: (lo <= x) & (x <= hi)
+
+
+def equals(val):
+    return lambda x: x == val
+
+
+def one_of(*vals):
+    return lambda x: functools.reduce(operator.or_, (x == v for v in vals))
+
+
+def at_most(val):
+    return lambda x: x <= val
+
+
+def is_set(x):
+    return x != 0
+
+
+def not_set(x):
+    return x == 0
+
+
+class Rubric:
+    """
+    Declarative checks of decoded fields, e.g. of segment descriptors, which
+    are evaluated for the fields of many students at once. A check is
+    (field, predicate, points, penalty): the predicate gets the values of
+    the field of all students and returns a mask of the passed checks, the
+    penalty is formatted with the value of the field.
+    Predicates only use operators, so they work on numpy arrays as well as on
+    single values, which are used for single rows or if numpy isn't
+    available.
+    """
+    def __init__(self, checks):
+        self.checks = tuple(checks)
+
+    @staticmethod
+    def _failed(predicate, values):
+        # indices of the rows failing the check, a column is only worth an
+        # array for more than one row
+        if numpy is not None and len(values) > 1:
+            mask = numpy.asarray(predicate(numpy.array(values)), dtype=bool)
+            return numpy.flatnonzero(~mask)
+        return [nr for nr, v in enumerate(values) if not predicate(v)]
+
+    def evaluate(self, rows):
+        """
+        :param rows: dicts of field -> value, e.g. one segment per student
+        :return: list of failed checks as (points, penalty) per row
+        """
+        failed = [[] for _ in rows]
+        for field, predicate, pts, penalty in self.checks:
+            values = [row[field] for row in rows]
+            for nr in self._failed(predicate, values):
+                failed[nr].append((pts, penalty.format(values[nr])))
+        return failed
+
+    def check(self, row):
+        """
+        :return: failed checks of a single row, see evaluate
+        """
+        return [(pts, penalty.format(row[field]))
+                for field, predicate, pts, penalty in self.checks
+                if not predicate(row[field])]
@@ -0,0 +1,157 @@
+"""
+Near-duplicate detection of task blocks with MinHash signatures and
+locality-sensitive hashing, so copied submissions can be found without
+comparing every pair of submissions.
+"""
+import re
+import random
+import hashlib
+
+from asm_interpreter import _strip_line
+
+_mersenne_prime = (1 << 61) - 1
+_max_hash = (1 << 32) - 1
+_token_pattern = re.compile(r"[\w$]+|[^\s\w]")
+
+
+def normalize_lines(lines):
+    """
+    Strip comments, whitespace and case from the lines of a task block
+    """
+    normalized = []
+    for l in lines:
+        l = " ".join(_strip_line(l).split()).lower()
+        if l:
+            normalized.append(l)
+    return normalized
+
+
+def shingles(lines, k=3):
+    """
+    Split the normalized lines into overlapping k-grams of tokens
+    :return: set of hashed shingles
+    """
+    tokens = _token_pattern.findall("\n".join(lines))
+    if not tokens:
+        return set()
+
+    grams = [" ".join(tokens[i:i + k])
+             for i in range(max(1, len(tokens) - k + 1))]
+    # stable across processes, unlike hash()
+    return {int.from_bytes(hashlib.blake2b(g.encode("utf-8"),
+                                           digest_size=4).digest(), "little")
+            for g in grams}
+
+
+class _UnionFind:
+    def __init__(self):
+        self._parent = {}
+
+    def find(self, x):
+        parent = self._parent
+        root = parent.setdefault(x, x)
+        while root != parent[root]:
+            root = parent[root]
+        # compress path
+        while x != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a, b):
+        self._parent[self.find(a)] = self.find(b)
+
+
+class SimilarityIndex:
+    """
+    Index of the task blocks of many submissions, which reports clusters of
+    submissions with (nearly) identical blocks per task
+    """
+    def __init__(self, num_perm=64, bands=8, threshold=0.8, k=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm has to be a multiple of bands")
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.k = k
+
+        rnd = random.Random(seed)
+        self._perms = [(rnd.randrange(1, _mersenne_prime),
+                        rnd.randrange(0, _mersenne_prime))
+                       for _ in range(num_perm)]
+        # task nr -> student -> signature
+        self._signatures = {}
+        # task nr -> (band, band values) -> students
+        self._buckets = {}
+
+    def signature(self, lines):
+        """
+        MinHash signature of a task block
+        :return: tuple of num_perm minimum hash values or None for an empty
+        block
+        """
+        shs = shingles(normalize_lines(lines), self.k)
+        if not shs:
+            return None
+
+        return tuple(min(((a * s + b) % _mersenne_prime) & _max_hash
+                         for s in shs)
+                     for a, b in self._perms)
+
+    def add(self, student, tasks):
+        """
+        Add the task blocks of a submission
+        :param student: name of the student
+        :param tasks: dict of task nr -> lines of the task block
+        """
+        for task_nr, lines in tasks.items():
+            sig = self.signature(lines)
+            if sig is None:
+                continue
+
+            self._signatures.setdefault(task_nr, {})[student] = sig
+            buckets = self._buckets.setdefault(task_nr, {})
+            for band in range(self.bands):
+                key = (band, sig[band * self.rows:(band + 1) * self.rows])
+                buckets.setdefault(key, []).append(student)
+
+    @staticmethod
+    def estimate(sig1, sig2):
+        """
+        Estimated Jaccard similarity of two signatures
+        """
+        return sum(a == b for a, b in zip(sig1, sig2)) / len(sig1)
+
+    def clusters(self):
+        """
+        Group the submissions with similar task blocks
+        :return: dict of task nr -> list of clusters, each a sorted list of
+        at least 2 student names
+        """
+        res = {}
+        for task_nr, buckets in self._buckets.items():
+            sigs = self._signatures[task_nr]
+            groups = _UnionFind()
+            checked = set()
+
+            for students in buckets.values():
+                first = students[0]
+                for other in students[1:]:
+                    pair = (first, other)
+                    if pair in checked:
+                        continue
+                    checked.add(pair)
+                    if (self.estimate(sigs[first], sigs[other]) >=
+                            self.threshold):
+                        groups.union(first, other)
+
+            members = {}
+            for student in sigs:
+                members.setdefault(groups.find(student), []).append(student)
+            clusters = sorted(sorted(m) for m in members.values()
+                              if len(m) > 1)
+            if clusters:
+                res[task_nr] = clusters
+
+        return res
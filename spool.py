@@ -0,0 +1,47 @@
+import os
+
+
+class SpoolWatcher:
+    """
+    Poll a spool directory for new or replaced submission zips. Polling
+    works on every filesystem, including network mounts without inotify.
+    """
+    def __init__(self, spool_dir, extension=".zip"):
+        self.spool_dir = spool_dir
+        self.extension = extension
+        # file name -> (size, mtime) when it was handed out
+        self._done = {}
+        # file name -> (size, mtime) seen at the previous poll
+        self._last = {}
+
+    def _scan(self):
+        stats = {}
+        with os.scandir(self.spool_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(self.extension):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.is_file():
+                    stats[entry.name] = (st.st_size, st.st_mtime_ns)
+        return stats
+
+    def poll(self):
+        """
+        Check the spool directory once
+        :return: sorted paths of the zips which arrived or changed and kept
+        their size and modification time since the previous poll, so
+        uploads which are still being written are left for later
+        """
+        stats = self._scan()
+        ready = [name for name, sig in stats.items()
+                 if self._last.get(name) == sig and
+                 self._done.get(name) != sig]
+
+        for name in ready:
+            self._done[name] = stats[name]
+        self._last = stats
+
+        return [os.path.join(self.spool_dir, name) for name in sorted(ready)]
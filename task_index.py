@@ -0,0 +1,96 @@
+import collections.abc
+import itertools
+import re
+
+# <AUFGABEn> starts and </AUFGABEn> ends the block of task n
+_marker_pattern = re.compile(r"<(/?)AUFGABE(\d+)>")
+
+
+class TaskBlock(collections.abc.Sequence):
+    """
+    Lines of a task block as view of the lines shared by all blocks of a
+    file
+    """
+    __slots__ = ("_lines", "start", "end")
+
+    def __init__(self, lines, start=0, end=0):
+        self._lines = lines
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._lines[self.start:self.end][i]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("task block index out of range")
+        return self._lines[self.start + i]
+
+    def __iter__(self):
+        return itertools.islice(self._lines, self.start, self.end)
+
+    def __eq__(self, other):
+        if isinstance(other, (TaskBlock, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "TaskBlock({!r})".format(list(self))
+
+
+class TaskIndex:
+    """
+    Blocks of all tasks of a file, which are found in a single pass over the
+    lines. Like reading every block on its own, a block starts after its
+    <AUFGABEn> marker and ends at its </AUFGABEn> marker or at the marker of
+    another task. Empty lines and comments aren't part of a block.
+    """
+    def __init__(self, lines):
+        # lines of all blocks, marker lines are never part of a block
+        self.lines = []
+        # task nr (as in the marker) -> (start, end) in lines
+        self.ranges = {}
+
+        reading = {}
+        for l in lines:
+            if "AUFGABE" in l:
+                markers = _marker_pattern.findall(l)
+                starts = {nr for slash, nr in markers if not slash}
+                for slash, nr in markers:
+                    if nr in self.ranges:
+                        continue
+                    if not slash:
+                        reading.setdefault(nr, len(self.lines))
+                    elif nr not in starts:
+                        # an end before the start leaves the block empty
+                        self.ranges[nr] = (reading.pop(nr, len(self.lines)),
+                                           len(self.lines))
+
+                if "<AUFGABE" in l:
+                    # the marker of another task ends a block
+                    for nr in [nr for nr in reading if nr not in starts]:
+                        self.ranges[nr] = (reading.pop(nr), len(self.lines))
+                    continue
+
+            if reading and l and not l.startswith(";"):
+                self.lines.append(l)
+
+        for nr, start in reading.items():
+            self.ranges[nr] = (start, len(self.lines))
+
+    def __getitem__(self, task_nr):
+        """
+        :param task_nr: number of the task
+        :return: TaskBlock, which is empty if the file has no such task
+        """
+        start, end = self.ranges.get(str(task_nr), (0, 0))
+        return TaskBlock(self.lines, start, end)
+
+    def __contains__(self, task_nr):
+        return str(task_nr) in self.ranges
@@ -0,0 +1,114 @@
+; protected mode bootstrap
+[bits 16]
+[org 0x7c00]
+
+start:
+	cli
+	xor ax, ax
+	mov ds, ax
+	lgdt [gdtr]
+
+; <AUFGABE2>
+	mov eax, cr0
+	or al, 0x01		; set PE bit
+	mov cr0, eax
+; </AUFGABE2>
+
+	jmp code:pmode
+
+[bits 32]
+pmode:
+; <AUFGABE3>
+	mov ax, data
+	mov ds, ax
+	mov ss, ax
+	mov ax, video
+	mov es, ax
+	mov ax, 0
+	mov fs, ax
+	mov gs, ax
+	mov esp, 0xBFFFFF
+; </AUFGABE3>
+
+; <AUFGABE5>
+	lidt [idtr]
+	sti
+	int 1
+; </AUFGABE5>
+
+; <AUFGABE7>
+	call startpaging
+	int 2
+; </AUFGABE7>
+
+hang:
+	jmp hang
+
+interrupthandler1:
+	mov byte [es:0], 'A'
+	iret
+
+interrupthandler2:
+	mov byte [es:2], 'B'
+	iret
+
+startpaging:
+	mov eax, 0x9C000
+	mov cr3, eax
+	mov eax, cr0
+	or eax, 0x80000000
+	mov cr0, eax
+	ret
+
+; <AUFGABE1>
+gdt:
+	dd 0, 0			; null descriptor
+code equ $-gdt
+	dw 0x0BFF		; limit 0-15
+	dw 0x0000		; base 0-15
+	db 0x00			; base 16-23
+	db 10011010b		; P, DPL, S, type
+	db 11000000b		; G, D/B, L, AVL, limit 16-19
+	db 0x00			; base 24-31
+data equ $-gdt
+	dw 0x0BFF
+	dw 0x0000
+	db 0x00
+	db 10010010b
+	db 11000000b
+	db 0x00
+video equ $-gdt
+	dw 0x7FFF
+	dw 0x8000
+	db 0x0B
+	db 10010010b
+	db 01000000b
+	db 0x00
+gdt_end:
+; </AUFGABE1>
+
+gdtr:
+	dw gdt_end - gdt - 1
+	dd gdt
+
+; <AUFGABE4>
+idtr:
+	dw idt_end - idt - 1
+	dd idt
+idt:
+	dd 0, 0
+	dw interrupthandler1
+	dw code
+	db 0x00
+	db 10001110b
+	dw 0x00
+	dw interrupthandler2
+	dw code
+	db 0x00
+	db 10001110b
+	dw 0x80
+idt_end:
+; </AUFGABE4>
+
+	times 510-($-$$) db 0
+	dw 0xAA55
@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from asm_expr import ExpressionError, compile_expression, evaluate
+
+
+class TestAsmExpr(TestCase):
+    def test_evaluate(self):
+        self.assertEqual(evaluate("0x10 + 2"), 18)
+        self.assertEqual(evaluate("1 + 2 * 3"), 7)
+        self.assertEqual(evaluate("(1 + 2) * 3"), 9)
+        self.assertEqual(evaluate("7 / 2"), 3)
+        self.assertEqual(evaluate("0x80 << 16 | 1"), 0x800001)
+        self.assertEqual(evaluate("-1 & 0xff"), 0xff)
+        self.assertEqual(evaluate("1010101b + 0bh + 1_000"), 85 + 11 + 1000)
+        self.assertEqual(evaluate("'A'"), 0x41)
+
+    def test_labels(self):
+        labels = {"gdt": 60, "gdt_end": 84}
+
+        self.assertEqual(evaluate("gdt_end - gdt - 1", labels), 23)
+        self.assertEqual(evaluate("$-gdt", labels, here=68), 8)
+        self.assertEqual(evaluate("510-($-$$)", here=500), 10)
+
+        with self.assertRaises(ExpressionError):
+            evaluate("idt_end - idt", labels)
+
+    def test_compile_expression(self):
+        expr = compile_expression("$-gdt")
+
+        self.assertEqual(expr.names, frozenset(["gdt"]))
+        self.assertFalse(expr.is_constant())
+        self.assertTrue(compile_expression("1+2").is_constant())
+        self.assertFalse(compile_expression("510-($-$$)").is_constant())
+
+        # every distinct expression is parsed once
+        self.assertIs(compile_expression("$-gdt"), expr)
+
+    def test_invalid(self):
+        for text in ["", "1 +", "(1 + 2", "2 ** 3", "[eax + 4]",
+                     "__import__('os').system('ls')", "1 if 1 else 2"]:
+            with self.assertRaises(ExpressionError):
+                evaluate(text)
+
+        with self.assertRaises(ExpressionError):
+            evaluate("1 / 0")
+
+    def test_shift_limit(self):
+        self.assertEqual(evaluate("1 << 64"), 1 << 64)
+        self.assertEqual(evaluate("-1 >> 64"), -1)
+        # huge shift counts would exhaust the memory
+        for text in ["1 + (1 << (1 << 40))", "1 >> (1 << 40)", "1 << 65",
+                     "1 << -1"]:
+            with self.assertRaises(ExpressionError):
+                evaluate(text)
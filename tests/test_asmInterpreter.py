@@ -1,7 +1,14 @@
-from unittest import TestCase
+import os
+import random
+from unittest import TestCase, mock, skipIf
+
+import asm_interpreter
 
 from asm_interpreter import AsmInterpreter, Registers, _determine_opsize, \
-    _tokenize_line, _parse_number
+    _tokenize_line, _parse_number, SourceLine, TokenStream, tokenize, decode, \
+    OPND_IMM, OPND_REG, OPND_LABEL, decode_descriptor_table, \
+    _parse_segment_descriptor, _parse_interrupt_descriptor, assemble, \
+    run_batch, SymbolTable
 
 
 class TestAsmInterpreter(TestCase):
@@ -81,6 +88,32 @@ class TestAsmInterpreter(TestCase):
         self.assertFalse(reg._is_segment("eax"))
         self.assertFalse(reg._is_segment("hs"))
 
+    def test_registers(self):
+        reg = Registers()
+
+        reg["eax"] = 0x12345678
+        self.assertEqual(reg["ax"], 0x5678)
+        self.assertEqual(reg["AH"], 0x56)
+        self.assertEqual(reg["al"], 0x78)
+
+        # sub-registers only change their own bits
+        reg["ah"] = 0xab
+        self.assertEqual(reg["eax"], 0x1234ab78)
+        reg["ax"] = 0x1ffff
+        self.assertEqual(reg["eax"], 0x1234ffff)
+
+        reg["esi"] = 0x10020
+        reg["di"] = reg["si"]
+        self.assertEqual(reg["edi"], 0x20)
+
+        reg["ds"] = 0x12345
+        self.assertEqual(reg["ds"], 0x2345)
+
+        self.assertIn("sp", reg)
+        self.assertNotIn("xy", reg)
+        self.assertIsNone(Registers.get_reg_key("xy"))
+        self.assertEqual(len(list(reg)), 19)
+
     def test__parse_descriptors(self):
         labels = {
             "code": 150,
@@ -140,6 +173,325 @@ class TestAsmInterpreter(TestCase):
         int_descr["offset"] = (labels["interrupthandler2"] + (0x80 << 16))
         self.assertDictEqual(descrs[2], int_descr)
 
+    def test_decode_descriptor_table(self):
+        idt = (b'\x00' * 8 + b'\xb4\x00\x96\x00\x00\x8e\x00\x00' +
+               b'\xbe\x00\x96\x00\x00\x8e\x80\x00' + b'\x12\x34')
+
+        for is_seg, parser in [(True, _parse_segment_descriptor),
+                               (False, _parse_interrupt_descriptor)]:
+            table = decode_descriptor_table(idt, is_seg)
+            entries = [parser(bytearray(idt[x:x + 8]))
+                       for x in range(0, len(idt), 8)]
+
+            self.assertEqual(len(table), 4)
+            self.assertEqual(list(table), entries)
+
+        self.assertEqual(list(table.columns["offset"][1:3]),
+                         [180, 190 + (0x80 << 16)])
+        self.assertEqual(list(table.columns["int_type"][:2]),
+                         ["invalid", "interrupt_gate"])
+        self.assertEqual(len(decode_descriptor_table(b'')), 0)
+
+    def test_assemble(self):
+        image = assemble(["[org 0x7c00]", "start:", "jmp start",
+                          "msg db 'hi', 0", "gdtr:", "dw gdt_end - gdt - 1",
+                          "dd gdt", "gdt:", "dd 0, 0", "code equ $-gdt",
+                          "dw 0x0bff, 0", "db 0, 10011010b, 11000000b, 0",
+                          "gdt_end:", "times 32-($-$$) db 0xff"])
+
+        self.assertEqual(image.origin, 0x7c00)
+        self.assertEqual(image.labels, {
+            "start": 0x7c00, "msg": 0x7c01, "gdtr": 0x7c04, "gdt": 0x7c0a,
+            "code": 8, "gdt_end": 0x7c1a})
+        self.assertEqual(image.equates, {"code": ("$-gdt", 0x7c12)})
+        self.assertEqual(len(image.data), 32)
+        self.assertEqual(bytes(image.read(0x7c01, 3)), b'hi\x00')
+        self.assertEqual(image.unpack("<HI", 0x7c04), (15, 0x7c0a))
+        self.assertEqual(bytes(image.read(0x7c1a, 8)), b'\xff' * 6)
+        self.assertIsNone(image.unpack("<HI", 0x8000))
+        self.assertIsNone(image.unpack("<HI", 0x7c00 - 6))
+
+    def test_assemble_size_limit(self):
+        lines = ["a: db 1", "resb 0x7fffffff", "times 400000000 db 0",
+                 "resd -4", "times 1<<(1<<40) db 0", "b: db 2"]
+        with self.assertLogs(level="WARNING") as logs:
+            image = assemble(lines)
+
+        self.assertEqual(len(logs.output), 4)
+        self.assertEqual(image.labels, {"a": 0, "b": 1})
+        self.assertEqual(bytes(image.data), b'\x01\x02')
+
+    def test_load_tables(self):
+        fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "data", "protected.asm")
+        with open(fixture) as f:
+            asm = AsmInterpreter(f.read().splitlines())
+        asm.interpret()
+
+        self.assertEqual(set(asm.tables), {"lgdt", "lidt"})
+        gdt = asm.descriptor_table("lgdt")
+        self.assertEqual(len(gdt), 4)
+        self.assertEqual(gdt[asm.labels["code"] // 8]["seglimit"], 0x0bff)
+        self.assertEqual(asm.parse_segment_descriptors()["data"], gdt[2])
+
+        idt = asm.descriptor_table("lidt")
+        self.assertEqual(idt[1]["offset"], asm.labels["interrupthandler1"])
+        self.assertEqual(idt[1]["segment"], asm.labels["code"])
+        self.assertEqual(list(idt),
+                         asm.parse_descriptors(is_seg_descriptor=False))
+
+    def test_tokenize(self):
+        lines = ["  mov eax, cr0 ; read cr0\n", "; <AUFGABE2>\n", "\n",
+                 "code equ $-gdt"]
+        stream = tokenize(lines)
+
+        self.assertIsInstance(stream, TokenStream)
+        self.assertIs(tokenize(stream), stream)
+        self.assertListEqual(stream, ["mov eax, cr0 ; read cr0",
+                                      "; <AUFGABE2>", "", "code equ $-gdt"])
+        self.assertListEqual([l.nr for l in stream], [0, 1, 2, 3])
+        self.assertEqual(stream[0].text, "mov eax, cr0")
+        self.assertEqual(stream[0].cmd, "mov")
+        self.assertListEqual(stream[0].params, ["eax", "cr0"])
+        self.assertEqual(stream[1].text, "")
+        self.assertEqual(stream[3].cmd, "code")
+
+        # already tokenized lines are reused
+        self.assertIs(tokenize(stream[:2])[1], stream[1])
+
+    def test__tokenize_line(self):
+        for l in ["mov eax, cr0", "or al, 0x01 ; PE", "[bits 32]", "",
+                  "dw idt_end - idt - 1", "lidt [idtr]"]:
+            self.assertEqual(_tokenize_line(l), _tokenize_line(SourceLine(l)))
+
+        self.assertEqual(_tokenize_line("or al, 0x01 ; PE"),
+                         ("or", ["al", "0x01"]))
+        self.assertEqual(_tokenize_line("dw idt_end - idt - 1"),
+                         ("dw", ["idt_end - idt - 1"]))
+
+    def test_decode(self):
+        program = decode(["start:", "mov eax, 0x10 + 2", "or al, cr0",
+                          "mov ds, data", "times 4 db 0", "mov [eax], 1"])
+
+        # labels, unknown commands and memory operands are left out
+        self.assertEqual(len(program), 3)
+        self.assertEqual([ins.operands[1].kind for ins in program],
+                         [OPND_IMM, OPND_REG, OPND_LABEL])
+        self.assertEqual(program[0].operands[1].value, 18)
+        self.assertEqual(program[1].operands[0].value,
+                         Registers.get_reg_key("al"))
+
+        self.assertEqual(program.targets, {"start": 0})
+
+        # identical code is decoded only once
+        self.assertIs(decode(["mov ds, data"]),
+                      decode([SourceLine("mov ds, data")]))
+
+    def test_interpret_repeated(self):
+        asm = AsmInterpreter(["mov ds, data", "or eax, 0x02"],
+                             {"data": 16})
+
+        asm.interpret()
+        regs = asm.interpret()
+        self.assertEqual(regs["ds"], 16)
+        self.assertEqual(regs["eax"], 2)
+
+        asm.interpret(["mov ds, missing"])
+        self.assertEqual(regs["ds"], 0)
+
+        # expressions are resolved with the labels of the interpreter
+        asm.interpret(["mov ecx, data * 2 + 1", "mov edx, 10 / 4"])
+        self.assertEqual(regs["ecx"], 33)
+        self.assertEqual(regs["edx"], 2)
+
+    def test_extract_labels(self):
+        asm = AsmInterpreter(["gdt:", "dd 0, 0", "code equ $-gdt",
+                              "broken equ gdt +", "gdt_end:"])
+
+        # labels are addresses of the memory image
+        self.assertEqual(asm.labels,
+                         {"gdt": 0, "code": 8, "broken": -1, "gdt_end": 8})
+
+    def test_symbol_table(self):
+        image = assemble(["a equ b + 1", "b equ c + 1", "c:", "db 0",
+                          "x equ y", "y equ x", "ext_ref equ ext + a"],
+                         {"ext": 0x100})
+        labels = image.labels
+        self.assertIsInstance(labels, SymbolTable)
+
+        # nothing is resolved before it is looked up
+        self.assertTrue(all(isinstance(v, tuple)
+                            for k, v in labels._defs.items() if k != "c"))
+        self.assertEqual(labels["ext_ref"], 0x102)
+        self.assertEqual(labels._defs["b"], 1)
+        self.assertIsInstance(labels._defs["x"], tuple)
+
+        # cycles fail instead of recursing forever
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(labels["x"], -1)
+        self.assertEqual(labels["y"], -1)
+        self.assertNotIn("ext", labels)
+        self.assertEqual(dict(labels), {"a": 2, "b": 1, "c": 0, "x": -1,
+                                        "y": -1, "ext_ref": 0x102})
+
+        # code without label operands is never assembled
+        asm = AsmInterpreter(["mov eax, 1"])
+        asm.interpret()
+        self.assertIsNone(asm._assembled)
+
+        # other labels assemble the image again
+        asm = AsmInterpreter(["dd ext"], {"ext": 1})
+        self.assertEqual(bytes(asm.image.data), b'\x01\x00\x00\x00')
+        asm.labels = {"ext": 2}
+        self.assertEqual(bytes(asm.image.data), b'\x02\x00\x00\x00')
+
+    def test_interpret_control_flow(self):
+        lines = [
+            "mov ecx, 0",
+            "mov eax, 5",
+            "again: add ecx, eax",
+            "dec eax",
+            "jnz again",
+            "cmp ecx, 15",
+            "jne fail",
+            "push ecx",
+            "call double",
+            "pop ebx",
+            "lidt [idtr]",
+            "int 2",
+            "call startpaging",
+            "hlt",
+            "fail:",
+            "mov ebx, 0xdead",
+            "double:",
+            "shl ecx, 1",
+            "ret"
+        ]
+        asm = AsmInterpreter(lines)
+        regs = asm.interpret()
+
+        self.assertEqual(regs["ecx"], 30)
+        self.assertEqual(regs["ebx"], 15)
+        self.assertEqual(regs["esp"], 0)
+        self.assertEqual(asm.calls, ["double", "startpaging"])
+        self.assertEqual(asm.interrupts, [2])
+        self.assertEqual(asm.loaded_tables, [("lidt", "idtr")])
+        self.assertFalse(asm.exhausted)
+
+    def test_interpret_invalid_ret(self):
+        for ret in ["-1", "100"]:
+            asm = AsmInterpreter(["push " + ret, "ret", "mov ebx, 7"])
+            with self.assertLogs(level="WARNING"):
+                regs = asm.interpret()
+
+            self.assertEqual(regs["ebx"], 0)
+            self.assertEqual(asm.steps, 2)
+            self.assertFalse(asm.exhausted)
+
+    def test_interpret_shift_count(self):
+        # only the low 5 bits of the count are used
+        asm = AsmInterpreter(["mov eax, 3", "shl eax, 0xffffffffff",
+                              "mov ecx, 0xffffffff", "mov ebx, 0x80000000",
+                              "shr ebx, ecx", "mov edx, 1", "shl edx, 33"])
+        regs = asm.interpret()
+
+        self.assertEqual(regs["eax"], 0x80000000)
+        self.assertEqual(regs["ebx"], 1)
+        self.assertEqual(regs["edx"], 2)
+        self.assertFalse(regs["eflags"] & asm.CF)
+
+    def test_interpret_step_budget(self):
+        asm = AsmInterpreter(["hang:", "inc eax", "jmp hang"], max_steps=100)
+        regs = asm.interpret()
+
+        self.assertTrue(asm.exhausted)
+        self.assertEqual(asm.steps, 100)
+        self.assertEqual(regs["eax"], 50)
+
+    def test_run_batch(self):
+        sources = [
+            ["mov eax, cr0", "or al, 0x01", "mov cr0, eax"],
+            ["mov ax, data", "mov ds, ax", "sub ax, 0x20", "mov ss, ax"],
+            ["mov eax, cr0", "xor al, 0x01", "add eax, 0xffffffff"],
+            # control flow isn't run in lockstep
+            ["mov ecx, 3", "again:", "inc eax", "loop again"],
+        ]
+        labels = [{}, {"data": 0x10}, {}, {}]
+
+        batch = run_batch([decode(l) for l in sources], labels)
+        self.assertEqual(len(batch), len(sources))
+        for nr, (lines, l) in enumerate(zip(sources, labels)):
+            asm = AsmInterpreter(lines, l)
+            ref = asm.interpret()
+            self.assertListEqual(list(batch.row(nr)), list(ref), nr)
+
+        self.assertListEqual([int(v) for v in batch.column("ss")],
+                             [0, 0xfff0, 0, 0])
+
+    def test_run_batch_starts(self):
+        prefix = AsmInterpreter(["mov eax, 0x10", "push 0x18"])
+        prefix.interpret()
+        sources = [["mov ds, ax"], ["pop ebx", "mov es, bx"]]
+
+        batch = run_batch([decode(l) for l in sources], starts=[prefix] * 2)
+        # both programs continue from the state of the prefix
+        self.assertListEqual([int(v) for v in batch.column("eax")],
+                             [0x10, 0x10])
+        self.assertListEqual([int(v) for v in batch.column("ds")], [0x10, 0])
+        self.assertListEqual([int(v) for v in batch.column("es")], [0, 0x18])
+        self.assertListEqual(prefix.stack, [0x18])
+
+    def test_fork(self):
+        asm = AsmInterpreter(["data: dd 0x11223344",
+                              "mov eax, cr0", "or al, 0x01", "mov cr0, eax",
+                              "push eax"])
+        asm.interpret()
+
+        lines = ["pop ebx", "mov ds, data"]
+        first = asm.fork()
+        other = asm.fork(labels={"data": 0x10})
+        first.interpret(lines)
+        other.interpret(lines)
+
+        for fork, ds in [(first, 0), (other, 0x10)]:
+            self.assertEqual(fork.regs["cr0"], 1)
+            self.assertEqual(fork.regs["ebx"], 1)
+            self.assertEqual(fork.regs["ds"], ds)
+            self.assertListEqual(fork.stack, [])
+        # the snapshot itself is unchanged
+        self.assertEqual(asm.regs["ebx"], 0)
+        self.assertListEqual(asm.stack, [1])
+        self.assertEqual(asm.labels["data"], 0)
+        # the memory image is shared unless the labels change
+        self.assertIs(first.image, asm.image)
+        self.assertEqual(other.image.unpack("<I", 0), (0x11223344,))
+
+    def _check_run_batch_parity(self):
+        rnd = random.Random(7)
+        dsts = ["eax", "ebx", "ax", "bl", "ah", "cx", "ds", "cr0"]
+        srcs = dsts[:6] + ["0", "1", "0xff", "0x7fffffff", "0x80000000",
+                           "0xffffffff", "data", "data + 0x10"]
+        sources = [["{} {}, {}".format(
+            rnd.choice(["mov", "or", "and", "xor", "add", "sub"]),
+            rnd.choice(dsts), rnd.choice(srcs))
+            for _ in range(rnd.randint(1, 8))] for _ in range(200)]
+        labels = [{"data": rnd.choice([0x10, 0xfffffff0, 0x12345678])}
+                  for _ in sources]
+
+        batch = run_batch([decode(l) for l in sources], labels)
+        for nr, (lines, l) in enumerate(zip(sources, labels)):
+            ref = AsmInterpreter(lines, l).interpret()
+            # all slots including eflags, with 32 bit wraparound
+            self.assertListEqual(batch.row(nr)._slots, ref._slots, lines)
+
+    def test_run_batch_lists(self):
+        with mock.patch.object(asm_interpreter, "numpy", None):
+            self._check_run_batch_parity()
+
+    @skipIf(asm_interpreter.numpy is None, "numpy isn't installed")
+    def test_run_batch_numpy(self):
+        self._check_run_batch_parity()
+
     def test__determine_opsize(self):
         self.fail()
 
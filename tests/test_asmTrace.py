@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+from asm_interpreter import AsmInterpreter
+from asm_trace import Tracer, TraceEntry
+import exc3_protected as exc
+
+
+class TestTracer(TestCase):
+    def test_trace(self):
+        entries = []
+        tracer = Tracer(history=2, callback=lambda asm, e: entries.append(e))
+        asm = AsmInterpreter(["mov eax, cr0", "or al, 0x01", "mov cr0, eax",
+                              "nop"], tracer=tracer)
+        asm.interpret()
+
+        self.assertEqual(len(entries), 4)
+        self.assertEqual(entries[1], TraceEntry(
+            2, 1, "or", "or al, 0x01", (("eax", 0, 1),)))
+        self.assertDictEqual(dict(tracer.counts),
+                             {"mov": 2, "or": 1, "nop": 1})
+
+        # only the last instructions are kept
+        self.assertListEqual(list(tracer.history), entries[2:])
+        self.assertListEqual(tracer.format_history(),
+                             ["#3 mov cr0, eax  (cr0 0x0 -> 0x1)", "#4 nop"])
+
+    def test_trace_step_budget(self):
+        tracer = Tracer(history=3)
+        asm = AsmInterpreter(["hang:", "inc eax", "jmp hang"], max_steps=10,
+                             tracer=tracer)
+        asm.interpret()
+
+        self.assertTrue(asm.exhausted)
+        self.assertDictEqual(dict(tracer.counts), {"inc": 5, "jmp": 5})
+        self.assertListEqual([e.pc for e in tracer.history], [1, 0, 1])
+
+    def test_post_mortem(self):
+        pen = exc._post_mortem(AsmInterpreter(["hang:", "jmp hang"]),
+                               history=2)
+        self.assertEqual(pen, "Programm terminiert nicht, zuletzt "
+                              "ausgefuehrt: #9999 jmp hang; #10000 jmp hang")
@@ -0,0 +1,28 @@
+from unittest import TestCase
+
+import async_pipeline
+
+
+class TestAsyncPipeline(TestCase):
+    def test_run(self):
+        state = {"read": 0, "max_pending": 0}
+        results = []
+
+        def jobs():
+            for i in range(200):
+                state["read"] += 1
+                state["max_pending"] = max(state["max_pending"],
+                                           state["read"] - len(results))
+                yield i, 2
+
+        count = async_pipeline.run(jobs(), pow, results.append, workers=2,
+                                   queue_size=3)
+
+        self.assertEqual(count, 200)
+        self.assertListEqual(sorted(results), [i ** 2 for i in range(200)])
+        # 2 queues, 4 graders, the reader and the writer
+        self.assertLessEqual(state["max_pending"], 2 * 3 + 4 + 2)
+
+    def test_run_error(self):
+        with self.assertRaises(TypeError):
+            async_pipeline.run([(1, "x")], pow, print)
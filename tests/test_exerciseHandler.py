@@ -1,5 +1,9 @@
-from unittest import TestCase
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
 import exc3_protected as exc
+from asm_interpreter import decode_descriptor_table
 
 
 class TestExerciseHandler(TestCase):
@@ -103,6 +107,21 @@ class TestExerciseHandler(TestCase):
         self.assertLess(pts, 0)
         self.assertGreater(len(penalties), 4)
 
+    def test__eval_segs(self):
+        # correct code segment, but neither a data nor a video segment
+        seg = decode_descriptor_table(
+            b'\xff\x0b\x00\x00\x00\x9a\xc0\x00')[0]
+        deductions = []
+        exc._eval_code_seg(seg, lambda *args: deductions.append(args))
+        self.assertListEqual(deductions, [])
+
+        self.assertEqual(exc._eval_data_seg(seg, None),
+                         (1, ["Falscher Segment Typ (type): 10"]))
+        self.assertEqual(exc._eval_video_seg(seg, None), (4, [
+            "Falsches Segmentlimit: 3071", "Falsche Basisadresse: 0",
+            "Falscher Segment Typ (type): 10",
+            "Granularität Bit darf nicht gesetzt sein (g)"]))
+
     def test__eval_data_seg(self):
         self.fail()
 
@@ -118,6 +137,178 @@ class TestExerciseHandler(TestCase):
         segbytes = exc._parse_descriptor_defines(lines)
         res = exc._eval_video_seg(segbytes)
 
+    def test_normalize_files(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            makefile = os.path.join(tmp, "Makefile_3")
+            write = os.path.join(tmp, "write_3.c")
+            for path in [makefile, write]:
+                with open(path, "w") as f:
+                    f.write("reference\n")
+
+            sub = os.path.join(tmp, "sub")
+            os.makedirs(sub)
+            with open(os.path.join(sub, "ue3.asm"), "w") as f:
+                f.write("mov eax, cr0\n")
+
+            with mock.patch.object(exc, "makefile_src", makefile), \
+                    mock.patch.object(exc, "write_src", write):
+                exc.ExerciseHandler.normalize_files(sub)
+
+                self.assertListEqual(sorted(os.listdir(sub)),
+                                     ["Makefile", "protected.asm", "write.c"])
+                # reference files are shared, not copied
+                self.assertTrue(os.path.samefile(
+                    makefile, os.path.join(sub, "Makefile")))
+
+                exc.ExerciseHandler.materialize_files(sub)
+
+                self.assertFalse(os.path.samefile(
+                    makefile, os.path.join(sub, "Makefile")))
+                with open(os.path.join(sub, "write.c"), "a") as f:
+                    f.write("modified\n")
+                with open(write) as f:
+                    self.assertEqual(f.read(), "reference\n")
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_task_memo(self):
+        fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "data")
+        exc.task_memo.clear()
+        first = exc.ExerciseHandler(fixture)
+        # a different segment type on its own line keeps the labels intact
+        code = [l.replace("10011010b", "10010010b")
+                for l in first._read_sourcecode(fixture)]
+
+        with mock.patch.object(exc.ExerciseHandler, "_grade_task_uncached",
+                               autospec=True,
+                               side_effect=exc.ExerciseHandler
+                               ._grade_task_uncached) as m:
+            ref = first.grade_submission()
+            self.assertEqual(m.call_count, 6)
+            m.reset_mock()
+
+            self.assertEqual(exc.ExerciseHandler(fixture).grade_submission(),
+                             ref)
+            self.assertEqual(m.call_count, 0)
+
+            other = exc.ExerciseHandler(code=code).grade_submission()
+            self.assertEqual(m.call_count, 1)
+            self.assertEqual(other[1][1],
+                             ["[-1] Falscher Segment Typ (type): 2"])
+            self.assertEqual(exc.ExerciseHandler(code=code).grade_submission(),
+                             other)
+
+        self.assertDictEqual(exc.task_memo.stats()[1],
+                             {"hits": 2, "misses": 2})
+        self.assertDictEqual(exc.task_memo.stats()[2],
+                             {"hits": 3, "misses": 1})
+
+    def test_task_memo_checked_labels(self):
+        fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "data")
+        code = [l.replace("mov ax, video", "mov ax, 0x18")
+                for l in exc.ExerciseHandler._read_sourcecode(fixture)]
+        # an extra descriptor moves the video segment from 0x18 to 0x20
+        pos = code.index("video equ $-gdt\n")
+        moved = code[:pos] + ["dd 0, 0\n"] + code[pos:]
+
+        exc.task_memo.clear()
+        first = exc.ExerciseHandler(code=code)
+        other = exc.ExerciseHandler(code=moved)
+        self.assertEqual(other.asm.labels["video"], 0x20)
+        self.assertEqual(first._grade_task(3, first.tasks[3]), (10, []))
+        # the same block is checked against the labels of the submission
+        self.assertEqual(other._grade_task(3, other.tasks[3]),
+                         (8, ["-2 Extra Segment falsch gesetzt"]))
+
+    def test_grade_submission_post_mortem(self):
+        fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "data")
+        code = [l.replace("\tsti", "spin: jmp spin")
+                for l in exc.ExerciseHandler._read_sourcecode(fixture)]
+
+        exc.task_memo.clear()
+        score, penalties = exc.ExerciseHandler(code=code).grade_submission()
+
+        # the trace of the endless loop ends up in the report
+        self.assertEqual(score, 60)
+        self.assertListEqual(penalties[5], [
+            "[-0] Programm terminiert nicht, zuletzt ausgefuehrt: " +
+            "; ".join("#{} jmp spin".format(step)
+                      for step in range(9993, 10001))])
+
+    def test_prefix_tasks(self):
+        fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "data")
+        code = exc.ExerciseHandler._read_sourcecode(fixture)
+        code.remove("\tmov ax, data\n")
+        # task 3 continues with the ax task 2 leaves
+        pos = code.index("; </AUFGABE2>\n")
+        codes = [code[:pos] + ["mov ax, {}\n".format(sel)] + code[pos:]
+                 for sel in ("0x10", "0x18")]
+
+        exc.task_memo.clear()
+        graders = [exc.ExerciseHandler(code=c) for c in codes]
+        self.assertEqual(graders[0].tasks[3], graders[1].tasks[3])
+        ref = [(10, []), (6, ["-2 Daten Segment falsch gesetzt",
+                              "-2 Stack Segment falsch gesetzt"])]
+        self.assertListEqual([g._grade_task(3, g.tasks[3]) for g in graders],
+                             ref)
+        # task 2 only runs once
+        self.assertIs(graders[0]._prefix(2), graders[0]._prefix(2))
+
+        exc.task_memo.clear()
+        graders = [exc.ExerciseHandler(code=c) for c in codes]
+        self.assertListEqual(exc.ExerciseHandler._grade_register_tasks(
+            3, [(g, g.tasks[3]) for g in graders]), ref)
+
+    def test_grade_batch(self):
+        fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "data")
+        code = exc.ExerciseHandler._read_sourcecode(fixture)
+        codes = [code, [l.replace("0xBFFFFF", "0xBFFFFE") for l in code],
+                 [l.replace("or al, 0x01", "or al, 0x02") for l in code],
+                 [l.replace("10011010b", "10010010b") for l in code]]
+
+        exc.task_memo.clear()
+        ref = [exc.ExerciseHandler(code=c).grade_submission() for c in codes]
+        exc.task_memo.clear()
+        graders = [exc.ExerciseHandler(code=c) for c in codes + codes]
+        self.assertListEqual(exc.ExerciseHandler.grade_batch(graders),
+                             ref + ref)
+        # graders hitting the memo don't keep results graded ahead
+        self.assertFalse(any(g._precomputed for g in graders))
+        self.assertEqual(ref[3][1][1],
+                         ["[-1] Falscher Segment Typ (type): 2"])
+
+        res = exc.ExerciseHandler._grade_register_tasks(
+            3, [(g, g.tasks[3]) for g in graders[:3]])
+        # the scalar interpreter grades single submissions alike
+        self.assertListEqual(
+            res, [g._grade_register_task(3, g.tasks[3]) for g in graders[:3]])
+        self.assertListEqual(res, [(10, []),
+                                   (6, ["-4 Stack Pointer falsch gesetzt"]),
+                                   (10, [])])
+        res = exc.ExerciseHandler._grade_register_tasks(
+            2, [(g, g.tasks[2]) for g in graders[:3]])
+        self.assertListEqual(
+            res, [g._grade_register_task(2, g.tasks[2]) for g in graders[:3]])
+        self.assertListEqual(res, [(5, []), (5, []),
+                                   (0, ["PE Bit has to be enabled in CR0"])])
+
+    def test__block_interpreter(self):
+        fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "data")
+        grader = exc.ExerciseHandler(fixture)
+
+        # lidt [idtr] of task 5 refers to the data of the whole file
+        asm = grader._block_interpreter(grader.tasks[5])
+        with self.assertNoLogs(level="WARNING"):
+            asm.interpret()
+        self.assertEqual(asm.tables["lidt"][1], grader.asm.labels["idt"])
+
     def test__parse_int_descriptor(self):
         self.fail()
 
@@ -0,0 +1,36 @@
+import os
+import sys
+import subprocess
+from unittest import TestCase
+
+import exercises
+
+
+class TestExercises(TestCase):
+    def tearDown(self):
+        exercises._registry.pop("dummy", None)
+        exercises._loaded.pop("dummy", None)
+
+    def test_main_imports_no_exercise(self):
+        out = subprocess.check_output(
+            [sys.executable, "-c",
+             "import sys, main; print('exc3_protected' in sys.modules)"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(out.strip(), b"False")
+
+    def test_get(self):
+        handler = exercises.get()
+        self.assertEqual(handler.get_exercise_name(), "Ue3")
+        self.assertIs(exercises.get("ue3"), handler)
+        self.assertIn("ue3", exercises.names())
+
+        with self.assertRaises(ValueError):
+            exercises.get("unknown")
+
+    def test_register(self):
+        exercises.register("dummy", "email.mime.text:MIMEText")
+        self.assertNotIn("dummy", exercises._loaded)
+        self.assertIn("dummy", exercises.names())
+
+        self.assertIs(exercises.get("dummy"),
+                      sys.modules["email.mime.text"].MIMEText)
@@ -0,0 +1,193 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+from zipfile import ZipFile
+
+import main
+from exc3_protected import ExerciseHandler, task_memo
+from grade_cache import GradeCache
+import timing
+
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def _make_archive(path, students, changed=()):
+    with open(os.path.join(fixture_dir, "protected.asm")) as f:
+        code = f.read()
+
+    with ZipFile(path, "w") as subs:
+        for nr, student in enumerate(students):
+            # vary the submissions a bit
+            src = "; {}\n".format(student) + code.replace(
+                "0xBFFFFF", hex(0xBFFFFF - nr % 2))
+            if student in changed:
+                src = src.replace("int 2", "int 3")
+            buf = io.BytesIO()
+            with ZipFile(buf, "w") as sub:
+                sub.writestr("ue3/{}.asm".format(student.split()[0]), src)
+                sub.writestr("ue3/Makefile", "all:\n")
+                sub.writestr("ue3/write.c", "int main() {}\n")
+            folder = "{}_{}_assignsubmission_file_".format(student, nr)
+            subs.writestr(folder + "/ue3.zip", buf.getvalue())
+
+
+class TestMain(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmp, "subs.zip")
+        self.students = ["Student {}".format(i) for i in range(6)]
+        _make_archive(self.archive, self.students)
+
+        self.prev_output_dir = main.output_dir
+        main.output_dir = os.path.join(self.tmp, "out")
+
+    def tearDown(self):
+        main.output_dir = self.prev_output_dir
+        shutil.rmtree(self.tmp)
+
+    def test_extract_name(self):
+        self.assertEqual(
+            main.extract_name("Max Muster_4711_assignsubmission_file_"),
+            "Max Muster")
+
+    def test_handle_submissions(self):
+        prev_cwd = os.getcwd()
+        grades = main.handle_submissions(self.archive)
+
+        self.assertEqual(os.getcwd(), prev_cwd)
+        self.assertListEqual(sorted(grades.keys()), self.students)
+        self.assertTrue(os.path.exists(os.path.join(
+            main.output_dir, "Student 0", "protected.asm")))
+
+    def test_handle_submissions_parallel(self):
+        serial = main.handle_submissions(self.archive)
+        parallel = main.handle_submissions(self.archive, workers=3)
+
+        self.assertDictEqual(serial, parallel)
+
+    def test_iter_archive_sources(self):
+        sources = dict(main.iter_archive_sources(self.archive))
+
+        self.assertListEqual(sorted(sources.keys()), self.students)
+        self.assertIn("\tmov esp, 0xbffffe\n", sources["Student 1"])
+        self.assertFalse(os.path.exists(main.output_dir))
+
+    def test_handle_submissions_in_memory(self):
+        in_memory = main.handle_submissions(self.archive, in_memory=True)
+        self.assertFalse(os.path.exists(main.output_dir))
+
+        on_disk = main.handle_submissions(self.archive)
+        self.assertDictEqual(in_memory, on_disk)
+
+    def test_handle_submissions_batched(self):
+        batched = main.handle_submissions(self.archive, batch_size=4)
+        self.assertFalse(os.path.exists(main.output_dir))
+
+        self.assertDictEqual(batched, main.handle_submissions(self.archive))
+
+    def test__select_source(self):
+        self.assertEqual(main._select_source(
+            ["ue3/", "ue3/Makefile", "ue3/foo.asm", "ue3/protected.asm"]),
+            "ue3/protected.asm")
+        self.assertEqual(main._select_source(["foo.asm", "write.c"]),
+                         "foo.asm")
+        self.assertIsNone(main._select_source(["a/foo.asm", "b/bar.asm"]))
+
+    def test_handle_submissions_cached(self):
+        cache_path = os.path.join(self.tmp, "grades.cache")
+        grade_fn = ExerciseHandler.grade_submission
+
+        with mock.patch.object(ExerciseHandler, "grade_submission",
+                               autospec=True, side_effect=grade_fn) as m:
+            cache = GradeCache(cache_path, "test-1")
+            first = main.handle_submissions(self.archive, cache=cache)
+            self.assertEqual(m.call_count, len(self.students))
+            m.reset_mock()
+
+            _make_archive(self.archive, self.students, changed=["Student 2"])
+            cache = GradeCache(cache_path, "test-1")
+            second = main.handle_submissions(self.archive, cache=cache)
+            self.assertEqual(m.call_count, 1)
+            self.assertDictEqual(first, second)
+            m.reset_mock()
+
+            # changing the rubric invalidates all grades
+            cache = GradeCache(cache_path, "test-2")
+            main.handle_submissions(self.archive, in_memory=True, cache=cache)
+            self.assertEqual(m.call_count, len(self.students))
+
+    def test_handle_submissions_timings(self):
+        task_memo.clear()
+        timing.enable()
+        try:
+            main.handle_submissions(self.archive, workers=2)
+            res = timing.summary()
+        finally:
+            timing.enable(False)
+            timing.collect()
+
+        for stage in ["submission", "extract_submission", "normalize_files",
+                      "read_sourcecode", "extract_labels"]:
+            self.assertGreaterEqual(res["stages"][stage]["count"], 6, stage)
+        # identical task blocks are only graded once per worker
+        self.assertGreaterEqual(res["stages"]["grade_task1"]["count"], 1)
+        self.assertEqual(len(res["slowest"]), len(self.students))
+
+    def test_iter_grades(self):
+        grades = list(main.iter_grades(self.archive, workers=2,
+                                       in_memory=True))
+
+        self.assertListEqual(sorted(g[0] for g in grades), self.students)
+        self.assertDictEqual({g[0]: g[1:] for g in grades},
+                             main.handle_submissions(self.archive))
+
+    def test_main(self):
+        main.main([self.archive, "--report", "txt", "csv", "jsonl"])
+
+        for tmpl in [main.report_name_template,
+                     main.live_report_name_template]:
+            with open(os.path.join(main.output_dir,
+                                   tmpl.format("Ue3", "jsonl"))) as f:
+                self.assertEqual(len(f.readlines()), len(self.students))
+
+        with open(os.path.join(main.output_dir, "Ue3_grades.txt")) as f:
+            rep = f.read()
+        main.print_report(main.handle_submissions(self.archive),
+                          os.path.join(self.tmp, "ref.txt"))
+        with open(os.path.join(self.tmp, "ref.txt")) as f:
+            self.assertEqual(rep, f.read())
+
+    def test_watch_submissions(self):
+        spool = os.path.join(self.tmp, "spool")
+        os.makedirs(spool)
+        with ZipFile(self.archive) as subs:
+            for member in subs.namelist()[:2]:
+                folder = member.split("/")[0]
+                with open(os.path.join(spool, folder + ".zip"), "wb") as f:
+                    f.write(subs.read(member))
+
+        grades = list(main.watch_submissions(spool, poll_interval=0,
+                                             polls=2))
+        self.assertListEqual(sorted(g[0] for g in grades),
+                             self.students[:2])
+
+    def test_handle_submissions_memo_stats(self):
+        task_memo.clear()
+        main.handle_submissions(self.archive, workers=2)
+
+        stats = task_memo.stats()
+        self.assertEqual(stats[3]["hits"] + stats[3]["misses"],
+                         len(self.students))
+        self.assertGreater(stats[2]["hits"], 0)
+
+    def test_grade_pipelined(self):
+        grades = {}
+
+        def write(student, score, penalties):
+            grades[student] = score, penalties
+
+        count = main.grade_pipelined(self.archive, write, workers=2)
+        self.assertEqual(count, len(self.students))
+        self.assertDictEqual(grades, main.handle_submissions(self.archive))
@@ -0,0 +1,69 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+import reports
+
+
+class TestReports(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.grades = [
+            ("Zoe", 50, {1: ["[-1] Falsche Basisadresse: 12"], 2: []}),
+            ("Adam", 60, {}),
+            ("Mia", 58, {4: ["[int1] offset falsch", "[int2] d falsch"]})
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def test_text_report(self):
+        with reports.TextReport(self._path("rep.txt"), 60) as rep:
+            rep.write(*self.grades[0])
+            rep.write(*self.grades[1])
+
+        with open(self._path("rep.txt"), encoding='utf-8') as f:
+            self.assertEqual(f.read(),
+                             "Zoe [50/60]:\n"
+                             "\tAufgabe 1:\n"
+                             "\t\t[-1] Falsche Basisadresse: 12\n"
+                             "\n\n"
+                             "Adam [60/60]:\n\n")
+
+    def test_jsonl_report(self):
+        with reports.JsonLinesReport(self._path("rep.jsonl"), 60) as rep:
+            rep.write(*self.grades[2])
+
+        with open(self._path("rep.jsonl"), encoding='utf-8') as f:
+            self.assertDictEqual(json.loads(f.readline()), {
+                "student": "Mia", "score": 58, "max_score": 60,
+                "penalties": {"4": self.grades[2][2][4]}})
+
+    def test_external_sort(self):
+        items = [(str(i % 97), i) for i in range(1000)]
+        spool = reports.ExternalSort(key=lambda x: x[0], chunk_size=64)
+        for i in items:
+            spool.add(i)
+
+        self.assertGreater(len(spool._runs), 1)
+        self.assertListEqual(list(spool), sorted(items, key=lambda x: x[0]))
+
+    def test_write_reports(self):
+        live = reports.CsvReport(self._path("live.csv"), 60)
+        final = reports.CsvReport(self._path("final.csv"), 60)
+        with live, final:
+            count = reports.write_reports(iter(self.grades), [live], [final],
+                                          chunk_size=2)
+        self.assertEqual(count, 3)
+
+        with open(self._path("live.csv"), encoding='utf-8') as f:
+            self.assertListEqual([l.split(',')[0] for l in f],
+                                 ["student", "Zoe", "Adam", "Mia"])
+        with open(self._path("final.csv"), encoding='utf-8') as f:
+            self.assertListEqual([l.split(',')[0] for l in f],
+                                 ["student", "Adam", "Mia", "Zoe"])
@@ -0,0 +1,53 @@
+import random
+from unittest import TestCase, mock, skipIf
+
+import rubric
+from rubric import Rubric
+
+
+class TestRubric(TestCase):
+    def test_evaluate(self):
+        checks = Rubric([
+            ("limit", rubric.between(10, 12), 2, "Falsches Limit: {}"),
+            ("type", rubric.one_of(2, 3), 1, "Falscher Typ: {}"),
+            ("p", rubric.is_set, 1, "Nicht praesent"),
+        ])
+        rows = [{"limit": 11, "type": 2, "p": True},
+                {"limit": 13, "type": 4, "p": False},
+                {"limit": 10, "type": 1, "p": True}]
+
+        self.assertListEqual(checks.evaluate(rows), [
+            [],
+            [(2, "Falsches Limit: 13"), (1, "Falscher Typ: 4"),
+             (1, "Nicht praesent")],
+            [(1, "Falscher Typ: 1")]])
+        self.assertListEqual(checks.check(rows[2]), [(1, "Falscher Typ: 1")])
+        self.assertListEqual(checks.evaluate([]), [])
+
+    def _check_columns(self):
+        rnd = random.Random(5)
+        checks = Rubric([
+            ("seglimit", rubric.between(3071, 3072), 1, "limit {}"),
+            ("base_addr", rubric.equals(0xB8000), 1, "base {}"),
+            ("type", rubric.one_of(10, 11, 14, 15), 1, "type {}"),
+            ("dpl", rubric.at_most(1), 1, "dpl {}"),
+            ("s", rubric.is_set, 1, "s {}"),
+            ("g", rubric.not_set, 1, "g {}"),
+        ])
+        rows = [{"seglimit": rnd.choice([0, 3071, 3072, 3073, 0xfffff]),
+                 "base_addr": rnd.choice([0, 0xB8000, 0xffffffff]),
+                 "type": rnd.randrange(16), "dpl": rnd.randrange(4),
+                 "s": rnd.random() < 0.5, "g": rnd.random() < 0.5}
+                for _ in range(300)]
+
+        # the columns give the same result as every row on its own
+        self.assertListEqual(checks.evaluate(rows),
+                             [checks.check(row) for row in rows])
+
+    def test_evaluate_lists(self):
+        with mock.patch.object(rubric, "numpy", None):
+            self._check_columns()
+
+    @skipIf(rubric.numpy is None, "numpy isn't installed")
+    def test_evaluate_numpy(self):
+        self._check_columns()
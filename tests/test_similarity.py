@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+from similarity import SimilarityIndex, normalize_lines
+
+task = [
+    "mov ax, data\t; data segment",
+    "mov ds, ax",
+    "mov ss, ax",
+    "mov ax, video",
+    "mov es, ax",
+    "mov esp, 0xBFFFFF",
+]
+
+
+class TestSimilarity(TestCase):
+    def test_normalize_lines(self):
+        self.assertListEqual(
+            normalize_lines(["  MOV  ax,   data ; comment", "", "; only"]),
+            ["mov ax, data"])
+
+    def test_clusters(self):
+        index = SimilarityIndex()
+        index.add("a", {3: task, 7: []})
+        # same block with other comments and whitespace
+        index.add("b", {3: ["  " + l.split(";")[0].upper() + " ; x"
+                            for l in task]})
+        index.add("c", {3: ["xor eax, eax", "mov cr3, eax", "int 2"]})
+        index.add("d", {3: ["mov ax, 0x10", "mov fs, ax", "mov gs, ax",
+                            "mov ebp, esp", "call kernel_main"]})
+
+        self.assertDictEqual(index.clusters(), {3: [["a", "b"]]})
+
+    def test_signature(self):
+        index = SimilarityIndex(num_perm=32, bands=4)
+        self.assertIsNone(index.signature(["; nothing"]))
+
+        sig1 = index.signature(task)
+        sig2 = index.signature(task[:-1] + ["mov esp, 0x9FFFF"])
+        self.assertEqual(len(sig1), 32)
+        self.assertEqual(index.estimate(sig1, sig1), 1.0)
+        self.assertLess(index.estimate(sig1, sig2), 1.0)
+        self.assertGreater(index.estimate(sig1, sig2), 0.3)
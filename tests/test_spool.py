@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from spool import SpoolWatcher
+
+
+class TestSpoolWatcher(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.tmp, name), "w") as f:
+            f.write(content)
+
+    def test_poll(self):
+        watcher = SpoolWatcher(self.tmp)
+        self._write("a.zip", "a")
+        self._write("notes.txt", "ignored")
+
+        # wait until the upload is stable
+        self.assertListEqual(watcher.poll(), [])
+        self.assertListEqual(watcher.poll(),
+                             [os.path.join(self.tmp, "a.zip")])
+        self.assertListEqual(watcher.poll(), [])
+
+        # still being written
+        self._write("b.zip", "b")
+        watcher.poll()
+        self._write("b.zip", "bbb")
+        self.assertListEqual(watcher.poll(), [])
+        self.assertListEqual(watcher.poll(),
+                             [os.path.join(self.tmp, "b.zip")])
+
+        # replaced upload is handed out again
+        self._write("a.zip", "a2")
+        watcher.poll()
+        self.assertListEqual(watcher.poll(),
+                             [os.path.join(self.tmp, "a.zip")])
@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+from asm_interpreter import tokenize
+from task_index import TaskIndex, TaskBlock
+
+
+class TestTaskIndex(TestCase):
+    def test_index(self):
+        lines = tokenize([
+            "; <AUFGABE1>",
+            "mov eax, 1",
+            "; comment",
+            "",
+            "mov ebx, 2",
+            "; </AUFGABE1>",
+            "; <AUFGABE2>",
+            "mov ecx, 3",
+            "; <AUFGABE3>",
+            "mov edx, 4",
+            "; </AUFGABE4>",
+            "; <AUFGABE4>",
+            "nop",
+        ])
+        index = TaskIndex(lines)
+
+        self.assertListEqual(list(index[1]), ["mov eax, 1", "mov ebx, 2"])
+        # the marker of another task ends a block
+        self.assertListEqual(list(index[2]), ["mov ecx, 3"])
+        self.assertListEqual(list(index[3]), ["mov edx, 4"])
+        # an end before the start leaves the block empty
+        self.assertListEqual(list(index[4]), [])
+        self.assertListEqual(list(index[5]), [])
+        self.assertIn(4, index)
+        self.assertNotIn(5, index)
+
+        # blocks are views of the same lines
+        self.assertIs(index[1]._lines, index[3]._lines)
+        self.assertEqual(len(index.lines), 4)
+
+    def test_block(self):
+        block = TaskBlock(["a", "b", "c", "d"], 1, 3)
+
+        self.assertEqual(len(block), 2)
+        self.assertEqual(block[-1], "c")
+        self.assertEqual(block[:1], ["b"])
+        self.assertEqual(block, ["b", "c"])
+        with self.assertRaises(IndexError):
+            block[2]
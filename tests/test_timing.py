@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+import timing
+
+
+class TestTiming(TestCase):
+    def setUp(self):
+        timing.collect()
+        timing.enable()
+
+    def tearDown(self):
+        timing.enable(False)
+        timing.collect()
+
+    def test_disabled(self):
+        timing.enable(False)
+        with timing.submission("a"):
+            with timing.stage("x"):
+                pass
+        timing.timed("y")(lambda: None)()
+
+        self.assertListEqual(timing.collect(), [])
+
+    def test_stage(self):
+        @timing.timed("y")
+        def fn(val):
+            return val * 2
+
+        with timing.submission("a"):
+            with timing.stage("x"):
+                self.assertEqual(fn(2), 4)
+        with timing.stage("x"):
+            pass
+
+        samples = timing.collect()
+        self.assertListEqual([(s[0], s[1]) for s in samples],
+                             [("y", "a"), ("x", "a"), ("submission", "a"),
+                              ("x", None)])
+
+    def test_summary(self):
+        timing.merge([("x", "a", 1.0), ("submission", "a", 3.0),
+                      ("x", "b", 2.0), ("submission", "b", 2.0),
+                      ("x", "b", 4.0)])
+        res = timing.summary(slowest=1)
+
+        self.assertDictEqual(res["stages"]["x"], {
+            "count": 3, "total": 7.0, "mean": 7.0 / 3,
+            "p50": 2.0, "p90": 4.0, "p99": 4.0, "max": 4.0})
+        self.assertListEqual(res["slowest"], [{
+            "submission": "a", "total": 3.0,
+            "stages": {"x": 1.0, "submission": 3.0}}])
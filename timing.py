@@ -0,0 +1,171 @@
+import json
+import time
+import functools
+
+# recording is switched off by default, stage() then hands out a shared
+# no-op context manager
+_enabled = False
+_submission = None
+# recorded (stage, submission, seconds) samples of this process
+_samples = []
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _samples.append((self.name, _submission,
+                         time.perf_counter() - self.start))
+        return False
+
+
+class _Submission(_Stage):
+    __slots__ = ("prev",)
+
+    def __init__(self, name):
+        super().__init__("submission")
+        self.prev = name
+
+    def __enter__(self):
+        global _submission
+        # remember the enclosing submission to restore it on exit
+        _submission, self.prev = self.prev, _submission
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        global _submission
+        super().__exit__(*exc)
+        _submission = self.prev
+        return False
+
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+def stage(name):
+    """
+    Time the enclosed block as the given stage of the current submission
+    :param name: name of the stage
+    :return: context manager
+    """
+    if not _enabled:
+        return _null_stage
+    return _Stage(name)
+
+
+def submission(name):
+    """
+    Attribute all stages of the enclosed block to the given submission
+    :param name: name of the submission
+    :return: context manager
+    """
+    if not _enabled:
+        return _null_stage
+    return _Submission(name)
+
+
+def timed(name):
+    """
+    Decorator timing every call of the function as the given stage
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def collect():
+    """
+    Take all samples recorded so far, e.g. to pass them from a worker
+    process to its parent
+    :return: list of (stage, submission, seconds) tuples
+    """
+    global _samples
+    samples, _samples = _samples, []
+    return samples
+
+
+def merge(samples):
+    _samples.extend(samples)
+
+
+def _percentile(values, p):
+    # nearest rank on sorted values
+    idx = max(0, -(-len(values) * p // 100) - 1)
+    return values[int(idx)]
+
+
+def _describe(values):
+    values = sorted(values)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "total": total,
+        "mean": total / len(values),
+        "p50": _percentile(values, 50),
+        "p90": _percentile(values, 90),
+        "p99": _percentile(values, 99),
+        "max": values[-1]
+    }
+
+
+def summary(slowest=10):
+    """
+    Summarize the recorded samples
+    :param slowest: number of slowest submissions to list
+    :return: dict with statistics per stage, over all submissions and the
+    stage breakdown of the slowest submissions
+    """
+    stages = {}
+    per_submission = {}
+    for name, sub, secs in _samples:
+        stages.setdefault(name, []).append(secs)
+        if sub is not None:
+            per_submission.setdefault(sub, {}).setdefault(name, 0)
+            per_submission[sub][name] += secs
+
+    totals = sorted(((s.get("submission", 0), sub)
+                     for sub, s in per_submission.items()), reverse=True)
+
+    return {
+        "stages": {k: _describe(v) for k, v in sorted(stages.items())},
+        "slowest": [{"submission": sub,
+                     "total": total,
+                     "stages": per_submission[sub]}
+                    for total, sub in totals[:slowest]]
+    }
+
+
+def write_summary(dst_file, slowest=10):
+    with open(dst_file, mode='w', encoding='utf-8') as f:
+        json.dump(summary(slowest), f, indent=2, sort_keys=True)